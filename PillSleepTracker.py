@@ -30,6 +30,9 @@ def _pip_install(package):
 _REQUIRED = {"customtkinter": "customtkinter", "matplotlib": "matplotlib", "PIL": "Pillow"}
 _OPTIONAL = {"pystray": "pystray"}
 
+# Batch reports and their worker processes never need the tray icon
+_HEADLESS = __name__ != "__main__" or sys.argv[1:2] == ["report"]
+
 _miss = []
 for _mod, _pkg in _REQUIRED.items():
     try: importlib.import_module(_mod)
@@ -40,23 +43,34 @@ if _miss:
         if not _pip_install(_pkg):
             print(f"  FAILED: {_pkg}  ->  pip install {_pkg}"); sys.exit(1)
     print("[PST] Ready.")
-for _mod, _pkg in _OPTIONAL.items():
+for _mod, _pkg in ({} if _HEADLESS else _OPTIONAL).items():
     try: importlib.import_module(_mod)
     except ImportError: _pip_install(_pkg)
+    except Exception: pass   # installed but unusable here (e.g. no display)
 
 # ==============================================================================
 #  SECTION 2 : IMPORTS
 # ==============================================================================
-import json, uuid, math, threading, csv
+import json, uuid, math, threading, csv, queue, time, hashlib, socket, gzip, marshal, html, argparse, bisect
+import logging, logging.handlers, traceback, io, zipfile, secrets, hmac
+import xml.etree.ElementTree as ET
 import tkinter as tk
-from tkinter import messagebox, filedialog
+from tkinter import messagebox, filedialog, ttk
 from datetime import datetime, timedelta
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+if sys.platform=="win32": import msvcrt
+else: import fcntl
 
 import customtkinter as ctk
+import numpy as np
 import matplotlib; matplotlib.use("TkAgg")
+import matplotlib.dates as mdates
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 
 try:
@@ -64,7 +78,7 @@ try:
 except ImportError: HAS_PIL = False
 try:
     import pystray; HAS_TRAY = True
-except ImportError: HAS_TRAY = False
+except Exception: HAS_TRAY = False
 
 # ==============================================================================
 #  SECTION 3 : THEME & CONSTANTS
@@ -98,77 +112,143 @@ DATA_DIR = Path(os.environ.get("APPDATA", Path.home())) / "PillSleepTracker"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 DATA_FILE = DATA_DIR / "tracker_data.json"
 SETTINGS_FILE = DATA_DIR / "settings.json"
+LOCK_FILE = DATA_DIR / "tracker_data.lock"
+CACHE_FILE = DATA_DIR / "tracker_data.cache"
+CACHE_MAGIC = b"PSTC\x02"
+INSTANCE_LOCK = DATA_DIR / "instance.lock"
+INSTANCE_PORT = DATA_DIR / "instance.port"
+BACKUP_DIR = DATA_DIR / "backups"
+STALL_LOG = DATA_DIR / "stalls.log"
+RECORD_KEYS = ("medications","med_log","sleep_log")
+OPLOG_MAX = 100
+SPAN_FMT = "%Y-%m-%dT%H:%M"
+MAX_SLEEP_MIN = 1080
 DEFAULT_SETTINGS = {"window_x":150,"window_y":80,"window_w":520,"window_h":740,
-                    "always_on_top":True,"opacity":0.96,"active_page":"dashboard"}
-
-class DataManager:
-    def __init__(self):
-        self.settings = self._load(SETTINGS_FILE, DEFAULT_SETTINGS.copy())
-        for k,v in DEFAULT_SETTINGS.items(): self.settings.setdefault(k,v)
-        self.data = self._load(DATA_FILE, {"medications":[],"med_log":[],"sleep_log":[]})
-        for k in ("medications","med_log","sleep_log"): self.data.setdefault(k,[])
+                    "always_on_top":True,"opacity":0.96,"active_page":"dashboard",
+                    "api_enabled":False,"api_port":8765,"api_token":"","single_instance":True,
+                    "backup_interval_min":15,"backup_full_days":7,"backup_keep_days":60,"backup_keep_full":8,
+                    "watchdog":True,"stall_ms":250,"day_boundary":18}
 
-    @staticmethod
-    def _load(path, default):
+class FileLock:
+    """Re-entrant cross-process lock on a sidecar file (msvcrt on Windows, fcntl elsewhere)."""
+    def __init__(self, path): self.path=path; self._fh=None; self._depth=0
+    def acquire(self, timeout=10.0):
+        if self._depth: self._depth+=1; return True
+        fh=open(self.path,"a+b"); end=time.monotonic()+timeout
+        while True:
+            try:
+                if sys.platform=="win32": fh.seek(0); msvcrt.locking(fh.fileno(),msvcrt.LK_NBLCK,1)
+                else: fcntl.flock(fh.fileno(),fcntl.LOCK_EX|fcntl.LOCK_NB)
+                self._fh=fh; self._depth=1; return True
+            except OSError:
+                if time.monotonic()>=end: fh.close(); return False
+                time.sleep(0.05)
+    def release(self):
+        if not self._depth: return
+        self._depth-=1
+        if self._depth: return
         try:
-            if path.exists():
-                with open(path,"r",encoding="utf-8") as f: return json.load(f)
-        except (json.JSONDecodeError, IOError): pass
-        return default
+            if sys.platform=="win32": self._fh.seek(0); msvcrt.locking(self._fh.fileno(),msvcrt.LK_UNLCK,1)
+            else: fcntl.flock(self._fh.fileno(),fcntl.LOCK_UN)
+        except OSError: pass
+        finally: self._fh.close(); self._fh=None
 
-    def save_data(self): self._write(DATA_FILE, self.data)
-    def save_settings(self): self._write(SETTINGS_FILE, self.settings)
+def sleep_span(s):
+    """(start, end) of a sleep_log entry as SPAN_FMT strings; derived from date/bedtime/waketime for entries
+    written before sessions had explicit spans. None if the entry is unusable."""
+    if s.get("start") and s.get("end"): return s["start"],s["end"]
+    try:
+        end=datetime.strptime(f"{s['date']} {s.get('waketime') or '07:00'}","%Y-%m-%d %H:%M")
+        dur=s.get("duration_min")
+        if not isinstance(dur,(int,float)) or dur<=0:
+            bh,bm=map(int,(s.get("bedtime") or "23:00").split(":")); dur=(end.hour*60+end.minute-bh*60-bm)%1440 or 1440
+        return (end-timedelta(minutes=dur)).strftime(SPAN_FMT),end.strftime(SPAN_FMT)
+    except (KeyError, ValueError, TypeError): return None
+def night_of(start, boundary=18):
+    """Night a session belongs to: one starting at or after `boundary` o'clock counts toward the next day."""
+    if isinstance(start,str): start=datetime.strptime(start,SPAN_FMT)
+    return (start+timedelta(hours=24-boundary)).strftime("%Y-%m-%d")
+def migrate_sleep(s, boundary=18):
+    """Give an entry its explicit start/end span and a stable id (in place), and fill date, bedtime, waketime
+    and duration_min from the span where missing. False if it has no usable span."""
+    sp=sleep_span(s)
+    if not sp: return False
+    try: a,b=(datetime.strptime(t,SPAN_FMT) for t in sp)
+    except (ValueError, TypeError): return False
+    if b<=a: return False
+    s["start"],s["end"]=sp; s.setdefault("id",str(uuid.uuid4())); s.setdefault("date",night_of(a,boundary))
+    s.setdefault("bedtime",a.strftime("%H:%M")); s.setdefault("waketime",b.strftime("%H:%M"))
+    s.setdefault("duration_min",int((b-a).total_seconds()//60)); return True
 
-    @staticmethod
-    def _write(path, obj):
-        try:
-            tmp=path.with_suffix(".tmp")
-            with open(tmp,"w",encoding="utf-8") as f: json.dump(obj,f,indent=2,ensure_ascii=False)
-            tmp.replace(path)
-        except IOError: pass
+class SleepIndex:
+    """Sleep sessions as intervals. Kept sorted by start so overlap and range queries are a bisect plus a
+    scan bounded by the longest session; nights maps each night (see night_of) to its sessions."""
+    def __init__(self, sessions, boundary=18):
+        self.boundary=boundary; self.longest=0; self.nights=defaultdict(list)
+        items=sorted(((sp,s) for s in sessions for sp in [sleep_span(s)] if sp),key=lambda x:x[0][0])
+        self.starts=[sp[0] for sp,_ in items]; self.ends=[sp[1] for sp,_ in items]; self.recs=[s for _,s in items]
+        for (a,b),s in items: self._note(a,b,s)
+    def _note(self, a, b, s):
+        self.nights[night_of(a,self.boundary)].append(s)
+        self.longest=max(self.longest,(datetime.strptime(b,SPAN_FMT)-datetime.strptime(a,SPAN_FMT)).total_seconds()/60)
+    def add(self, s):
+        sp=sleep_span(s)
+        if not sp: return
+        i=bisect.bisect_right(self.starts,sp[0])
+        self.starts.insert(i,sp[0]); self.ends.insert(i,sp[1]); self.recs.insert(i,s); self._note(*sp,s)
+    def remove(self, s):
+        sp=sleep_span(s)
+        if not sp: return
+        i=bisect.bisect_left(self.starts,sp[0])
+        while i<len(self.recs) and self.starts[i]==sp[0]:
+            if self.recs[i] is s:
+                del self.starts[i],self.ends[i],self.recs[i]; break
+            i+=1
+        n=self.nights.get(night_of(sp[0],self.boundary),[])
+        for j,x in enumerate(n):
+            if x is s: del n[j]; break
+    def between(self, a, b):
+        """Sessions overlapping [a, b) in start order."""
+        lo=bisect.bisect_left(self.starts,(datetime.strptime(a,SPAN_FMT)-timedelta(minutes=self.longest)).strftime(SPAN_FMT))
+        hi=bisect.bisect_left(self.starts,b)
+        return [self.recs[i] for i in range(lo,hi) if self.ends[i]>a]
+    def night(self, d):
+        """The night's only session, or a duration-weighted summary when there are naps or split sleep."""
+        ss=self.nights.get(d)
+        if not ss: return None
+        if len(ss)==1: return ss[0]
+        main=max(ss,key=lambda s:s.get("duration_min",0)); tot=sum(s.get("duration_min",0) for s in ss) or 1
+        wavg=lambda k,dflt:sum(s.get(k,dflt)*s.get("duration_min",0) for s in ss)/tot
+        fac=list(dict.fromkeys(f for s in ss for f in s.get("factors",[])))
+        return {"date":d,"bedtime":main.get("bedtime"),"waketime":main.get("waketime"),
+                "start":min(sleep_span(s)[0] for s in ss),"end":max(sleep_span(s)[1] for s in ss),
+                "duration_min":sum(s.get("duration_min",0) for s in ss),"quality":int(round(wavg("quality",3))),
+                "score":int(round(wavg("score",0))) if all(isinstance(s.get("score"),(int,float)) for s in ss) else "--",
+                "factors":fac,"sessions":len(ss)}
+
+class DataView:
+    """Read-only query helpers over a tracker data dict (live data or an API snapshot)."""
+    def __init__(self, data, day_boundary=18): self.data=data; self.day_boundary=day_boundary; self._tidx=None; self._sidx=None
 
     @property
     def meds(self): return [m for m in self.data["medications"] if m.get("active",True)]
     @property
     def all_meds(self): return self.data["medications"]
-
-    def add_med(self, d):
-        d.setdefault("id",str(uuid.uuid4())); d.setdefault("created",datetime.now().isoformat())
-        d.setdefault("active",True); self.data["medications"].append(d); self.save_data()
-    def update_med(self, mid, upd):
-        for m in self.data["medications"]:
-            if m["id"]==mid: m.update(upd); break
-        self.save_data()
-    def delete_med(self, mid):
-        self.data["medications"]=[m for m in self.data["medications"] if m["id"]!=mid]; self.save_data()
     def get_med(self, mid):
         for m in self.data["medications"]:
             if m["id"]==mid: return m
         return None
 
-    def log_taken(self, mid, name):
-        self.data["med_log"].append({"med_id":mid,"med_name":name,
-            "date":datetime.now().strftime("%Y-%m-%d"),"time":datetime.now().strftime("%H:%M:%S"),"action":"taken"})
-        med=self.get_med(mid)
-        if med and med.get("supply") is not None and med["supply"]>0: med["supply"]-=1
-        self.save_data()
-
-    def undo_taken(self, mid, date=None):
-        date=date or datetime.now().strftime("%Y-%m-%d")
-        for i in range(len(self.data["med_log"])-1,-1,-1):
-            l=self.data["med_log"][i]
-            if l["med_id"]==mid and l["date"]==date and l["action"]=="taken":
-                self.data["med_log"].pop(i)
-                med=self.get_med(mid)
-                if med and med.get("supply") is not None: med["supply"]+=1
-                break
-        self.save_data()
-
-    def taken_today(self, mid):
-        d=datetime.now().strftime("%Y-%m-%d")
-        return any(l["med_id"]==mid and l["date"]==d and l["action"]=="taken" for l in self.data["med_log"])
-    def taken_on_date(self, mid, d):
-        return any(l["med_id"]==mid and l["date"]==d and l["action"]=="taken" for l in self.data["med_log"])
+    def _taken(self):
+        """(med_id, date) -> taken records, built once and then kept current by DataManager."""
+        if self._tidx is None:
+            idx=defaultdict(list)
+            for l in self.data["med_log"]:
+                if l.get("action")=="taken": idx[(l["med_id"],l["date"])].append(l)
+            self._tidx=idx
+        return self._tidx
+    def taken_today(self, mid): return bool(self._taken().get((mid,datetime.now().strftime("%Y-%m-%d"))))
+    def taken_on_date(self, mid, d): return bool(self._taken().get((mid,d)))
 
     def adherence_for_range(self, days=7):
         result=[]; ids={m["id"] for m in self.meds}; total=len(ids) or 1
@@ -178,19 +258,31 @@ class DataManager:
             result.append((d, taken/total))
         return result
 
-    def log_sleep(self, entry):
-        entry.setdefault("logged_at",datetime.now().isoformat())
-        self.data["sleep_log"]=[s for s in self.data["sleep_log"] if s["date"]!=entry["date"]]
-        self.data["sleep_log"].append(entry); self.save_data()
-    def get_sleep(self, d):
-        for s in self.data["sleep_log"]:
-            if s["date"]==d: return s
-        return None
+    def _sleep(self):
+        if self._sidx is None: self._sidx=SleepIndex(self.data["sleep_log"],self.day_boundary)
+        return self._sidx
+    def get_sleep(self, d): return self._sleep().night(d)
+    def sessions_between(self, a, b):
+        """Sleep sessions overlapping a..b (datetimes or SPAN_FMT strings)."""
+        f=lambda t:t.strftime(SPAN_FMT) if isinstance(t,datetime) else t
+        return self._sleep().between(f(a),f(b))
+    def impact_night(self, d):
+        """Night d as FactorImpact sees it: naps folded into the night, nap-only days left out."""
+        n=self._sleep().night(d)
+        return n if n and n.get("duration_min",0)>=FactorImpact.MIN_NIGHT_MIN else None
+    def impact_nights(self): return [n for d in list(self._sleep().nights) for n in [self.impact_night(d)] if n]
+    def recent_sessions(self, n=10): return self._sleep().recs[-n:][::-1]
     def sleep_for_range(self, days=14):
-        r=[]
+        idx=self._sleep(); r=[]
         for i in range(days-1,-1,-1):
-            d=(datetime.now()-timedelta(days=i)).strftime("%Y-%m-%d"); r.append((d,self.get_sleep(d)))
+            d=(datetime.now()-timedelta(days=i)).strftime("%Y-%m-%d"); r.append((d,idx.night(d)))
         return r
+    def history_days(self):
+        """Days from the first logged dose or night up to today (at least 7)."""
+        ds=[s["date"] for s in self.data["sleep_log"]]+[l["date"] for l in self.data["med_log"]]
+        if not ds: return 7
+        try: return max(7,(datetime.now()-datetime.strptime(min(ds),"%Y-%m-%d")).days+1)
+        except ValueError: return 7
 
     def pill_streak(self):
         ids={m["id"] for m in self.meds}
@@ -203,14 +295,412 @@ class DataManager:
             else: break
         return streak
     def sleep_streak(self):
-        streak=0
+        streak=0; nights=self._sleep().nights
         for i in range(365):
             d=(datetime.now()-timedelta(days=i)).strftime("%Y-%m-%d")
-            if self.get_sleep(d): streak+=1
+            if nights.get(d): streak+=1
             elif i==0: continue
             else: break
         return streak
 
+def migrate_import(imp):
+    """Tracker data from an export (v1 or v2) with v1 names mapped, or None if it is not tracker data."""
+    if not isinstance(imp,dict) or not any(k in imp for k in ("medications","med_log","sleep_log","pills")): return None
+    if "pills" in imp and "medications" not in imp:
+        imp["medications"]=imp.pop("pills")
+        for m in imp["medications"]: m.setdefault("id",str(uuid.uuid4()))
+    if "pill_log" in imp and "med_log" not in imp:
+        imp["med_log"]=imp.pop("pill_log")
+        for l in imp["med_log"]: l.setdefault("med_id",l.get("pill_name","")); l.setdefault("med_name",l.get("pill_name",""))
+    for k in RECORD_KEYS: imp.setdefault(k,[])
+    imp["sleep_log"]=[s for s in imp["sleep_log"] if isinstance(s,dict) and migrate_sleep(s)]
+    return imp
+
+class SleepOverlap(ValueError):
+    """A new sleep session overlaps ones already logged (available as .sessions)."""
+    def __init__(self, sessions):
+        self.sessions=sessions
+        super().__init__("Overlaps "+", ".join(f"{s.get('bedtime')}-{s.get('waketime')} ({s.get('date')})" for s in sessions))
+
+class Op:
+    """One reversible DataManager change; do/undo close over the exact records they touch."""
+    __slots__=("label","do","undo","ts")
+    def __init__(self, label, do, undo): self.label=label; self.do=do; self.undo=undo; self.ts=datetime.now()
+
+class DataManager(DataView):
+    def __init__(self):
+        self.settings = self._load(SETTINGS_FILE, DEFAULT_SETTINGS.copy())
+        for k,v in DEFAULT_SETTINGS.items(): self.settings.setdefault(k,v)
+        super().__init__({k:[] for k in RECORD_KEYS},int(self.settings["day_boundary"]))
+        self._lock=threading.RLock(); self._mq=queue.Queue(); self.rev=0; self._snap=(-1,None)
+        self._flock=FileLock(LOCK_FILE); self._base={k:Counter() for k in RECORD_KEYS}; self._base_raw=None; self._sig=None
+        self.impact=FactorImpact(); self._cache_sig=None; self.corrupt_file=None; self.dirty=False
+        self._undo=deque(maxlen=OPLOG_MAX); self._redo=[]; self.listeners=[]
+        sig,raw=self._read_raw()
+        if sig and not self._load_cache(sig,raw): self._load_json(sig,raw)   # cache is (re)written on autosave
+        if self._sig is None and DATA_FILE.exists() and DATA_FILE.stat().st_size:
+            # Unreadable file: move it aside so the next save cannot overwrite it
+            self.corrupt_file=DATA_FILE.with_name(f"tracker_data.corrupt-{datetime.now():%Y%m%d-%H%M%S}.json")
+            try: DATA_FILE.replace(self.corrupt_file)
+            except OSError: pass
+        if any(k not in s for s in self.data["sleep_log"] for k in ("start","end","id","date","duration_min")):
+            # One-time upgrade: date/bedtime/waketime entries become explicit start/end sessions
+            self.data["sleep_log"]=[s for s in self.data["sleep_log"] if migrate_sleep(s,self.day_boundary)]; self.save_data()
+
+    @staticmethod
+    def _load(path, default):
+        try:
+            if path.exists():
+                with open(path,"r",encoding="utf-8") as f: return json.load(f)
+        except (json.JSONDecodeError, IOError): pass
+        return default
+
+    def save_data(self, wait=5):
+        """Merge and write under the inter-process lock. If the lock is not free within `wait` seconds nothing
+        is written: the data stays dirty for the next save or check_external() to retry. True once on disk."""
+        with self._lock:
+            if not self._flock.acquire(wait): self.dirty=True; return False
+            try:
+                self._merge_from_disk()
+                text,lines=self._dump_records(self.data); raw=text.encode("utf-8")
+                tmp=DATA_FILE.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp,"wb") as f: f.write(raw)
+                tmp.replace(DATA_FILE); st=DATA_FILE.stat()
+                self._base={k:Counter(v) for k,v in lines.items()}; self._base_raw=None
+                self._sig=(st.st_mtime_ns,len(raw),hashlib.sha256(raw).hexdigest()); self.dirty=False
+            except IOError: self.dirty=True
+            finally: self._flock.release()
+            return not self.dirty
+    def save_settings(self): self._write(SETTINGS_FILE, self.settings)
+
+    @staticmethod
+    def _write(path, obj):
+        try:
+            tmp=path.with_suffix(".tmp")
+            with open(tmp,"w",encoding="utf-8") as f: json.dump(obj,f,indent=2,ensure_ascii=False)
+            tmp.replace(path)
+        except IOError: pass
+
+    # ── Multi-instance sync ──────────────────────────────────────────────────
+    # tracker_data.json is written one record per line so another instance's
+    # edits can be merged by diffing lines: only new/changed lines are parsed.
+    @staticmethod
+    def _rec_line(r): return json.dumps(r,ensure_ascii=False,sort_keys=True)
+    def _dump_records(self, data):
+        lines={k:[self._rec_line(r) for r in data.get(k,[])] for k in RECORD_KEYS}
+        parts=[f'"{k}": [\n'+"".join(l+(",\n" if i<len(lines[k])-1 else "\n") for i,l in enumerate(lines[k]))+"]"
+               for k in RECORD_KEYS]
+        parts+=[json.dumps(k)+": "+json.dumps(v,ensure_ascii=False) for k,v in data.items() if k not in RECORD_KEYS]
+        return "{\n"+",\n".join(parts)+"\n}\n", lines
+    @staticmethod
+    def _split_records(text):
+        lines={}; extras={}; cur=None
+        for ln in text.split("\n"):
+            if cur is None:
+                k=next((k for k in RECORD_KEYS if ln==f'"{k}": ['),None)
+                if k: cur=k; lines[k]=[]
+                elif ln not in ("{","}",""):
+                    try: extras.update(json.loads("{"+ln.rstrip(",")+"}"))
+                    except ValueError: return None
+            elif ln in ("]","],"): cur=None
+            elif ln: lines[cur].append(ln[:-1] if ln.endswith(",") else ln)
+        return (lines,extras) if cur is None and len(lines)==len(RECORD_KEYS) else None
+    def _parse_layout(self, raw):
+        text=raw.decode("utf-8"); res=self._split_records(text)
+        if res: return res
+        data=json.loads(text)   # pretty-printed v2.0 file or hand-edited: full parse once
+        if not isinstance(data,dict): raise ValueError("not tracker data")
+        return ({k:[self._rec_line(r) for r in data.get(k,[])] for k in RECORD_KEYS},
+                {k:v for k,v in data.items() if k not in RECORD_KEYS})
+    @staticmethod
+    def _parse_rec(line):
+        r=json.loads(line)
+        if not isinstance(r,dict): raise ValueError(f"record is not an object: {line[:40]}")
+        return r
+    @staticmethod
+    def _read_raw():
+        try:
+            with open(DATA_FILE,"rb") as f: st=os.fstat(f.fileno()); raw=f.read()
+        except OSError: return None,None
+        return (st.st_mtime_ns,len(raw),hashlib.sha256(raw).hexdigest()),raw
+    @staticmethod
+    def _rec_key(k, r, line):
+        if k=="medications": return r.get("id",line)
+        if k=="sleep_log": return r.get("id") or r.get("date",line)
+        return line
+
+    def _merge_from_disk(self):
+        """Fold records another instance changed on disk into memory; True if anything was merged."""
+        if self._sig:
+            try: st=DATA_FILE.stat()
+            except OSError: return False
+            if (st.st_mtime_ns,st.st_size)==self._sig[:2]: return False
+        sig,raw=self._read_raw()
+        if sig is None: return False
+        if self._sig and sig[2]==self._sig[2]: self._sig=sig; return False
+        try:
+            lines,extras=self._parse_layout(raw)
+            # Only changed lines are parsed, but all of them before anything is touched: one truncated or
+            # zero-filled record makes the whole file unreadable (moved aside at startup, retried later)
+            bases=self._get_base()
+            parsed={l:self._parse_rec(l) for k in RECORD_KEYS for l in Counter(lines[k])-bases[k]}
+        except (ValueError, UnicodeDecodeError): return False   # half-synced file: retry on next check
+        changed=False
+        for k in RECORD_KEYS:
+            # Multisets: identical med_log lines (e.g. untimed v1 doses) are separate records
+            base=bases[k]; disk=Counter(lines[k]); gone=base-disk; added=disk-base
+            if not gone and not added: continue
+            local=[(self._rec_line(r),r) for r in self.data.get(k,[])]
+            ahead=Counter(l for l,_ in local)-base   # local lines not yet on disk
+            mine={self._rec_key(k,r,l) for l,r in local if l in ahead}
+            new={}
+            for l,c in added.items():
+                r=parsed[l]; key=self._rec_key(k,r,l)
+                if key not in mine: new.setdefault(key,[]).extend([r]+[json.loads(l) for _ in range(c-1)])
+            merged=[]
+            for l,r in local:   # edited records keep their position, deleted ones drop out
+                if not gone[l]: merged.append(r); continue
+                gone[l]-=1; key=self._rec_key(k,r,l)
+                if new.get(key): merged.append(new[key].pop(0))
+            self.data[k]=merged+[r for rs in new.values() for r in rs]; changed=True
+        for k,v in extras.items():
+            if self.data.get(k)!=v: self.data[k]=v; changed=True
+        self._base={k:Counter(lines[k]) for k in RECORD_KEYS}; self._base_raw=None; self._sig=sig
+        if changed:
+            # Records were swapped for their on-disk versions, so recorded ops would point at stale objects
+            self.impact.invalidate(); self._tidx=self._sidx=None; self._undo.clear(); self._redo.clear()
+        return changed
+    def _get_base(self):
+        """Record lines as of the last load or save. After startup they are split out of the raw file
+        only when first needed (a save or an external change), so loading never builds them."""
+        if self._base is None:
+            lines,_=self._parse_layout(self._base_raw)
+            self._base={k:Counter(lines[k]) for k in RECORD_KEYS}; self._base_raw=None
+        return self._base
+    def _load_json(self, sig, raw):
+        """Startup parse: one json.loads of the whole file. False if it is not readable tracker data."""
+        try:
+            data=json.loads(raw)
+            if not isinstance(data,dict): raise ValueError("not tracker data")
+            for k in RECORD_KEYS:
+                recs=data.setdefault(k,[])
+                if not isinstance(recs,list) or not all(isinstance(r,dict) for r in recs): raise ValueError(f"bad {k}")
+        except (ValueError, UnicodeDecodeError): return False
+        self.data=data; self._base=None; self._base_raw=raw; self._sig=sig; return True
+
+    # ── Fast-load cache ──────────────────────────────────────────────────────
+    # A marshal copy of the records only, keyed to the JSON's (mtime, size, sha256). Repeated strings
+    # (ids, names, dates) are interned first so marshal stores each once. The JSON stays the source of
+    # truth; a stale or unreadable cache is simply ignored.
+    def _load_cache(self, sig, raw):
+        try:
+            with open(CACHE_FILE,"rb") as f: blob=f.read()
+            if not blob.startswith(CACHE_MAGIC): return False
+            csig,data=marshal.loads(blob[len(CACHE_MAGIC):])
+        except (OSError, ValueError, EOFError, TypeError): return False
+        if tuple(csig)!=sig or not isinstance(data,dict): return False
+        self.data=data; self._base=None; self._base_raw=raw; self._sig=self._cache_sig=sig
+        return True
+    def write_cache(self):
+        """Rewrite the cache if it lags the JSON and nothing is waiting to be saved (memory == disk)."""
+        with self._lock:
+            if not self._sig or self._cache_sig==self._sig or self.dirty: return False
+            it=sys.intern
+            for k in RECORD_KEYS:
+                for r in self.data[k]:
+                    for f,v in r.items():
+                        if type(v) is str and len(v)<=64: r[f]=it(v)
+            blob=CACHE_MAGIC+marshal.dumps((self._sig,self.data))
+            try:
+                tmp=CACHE_FILE.with_name(f"{CACHE_FILE.name}.{os.getpid()}.tmp"); tmp.write_bytes(blob); tmp.replace(CACHE_FILE)
+            except (OSError, ValueError): return False
+            self._cache_sig=self._sig; return True
+
+    def check_external(self):
+        with self._lock:
+            changed=self._merge_from_disk()
+            if self.dirty: self.save_data(0.2)   # an earlier save could not get the file lock
+            if changed: self.rev+=1
+            return changed
+
+    # ── Cross-thread access ──────────────────────────────────────────────────
+    def snapshot(self):
+        """Consistent read-only copy for other threads; rebuilt only after a write."""
+        rev,view=self._snap
+        if rev!=self.rev or view is None:
+            with self._lock: rev=self.rev; view=DataView(json.loads(json.dumps(self.data)),self.day_boundary)
+            self._snap=(rev,view)
+        return view
+    def submit(self, fn, *a):
+        """Queue a write from another thread; it runs on the UI thread at the next pump()."""
+        f=Future(); self._mq.put((fn,a,f)); return f
+    def pump(self):
+        n=0
+        while True:
+            try: fn,a,f=self._mq.get_nowait()
+            except queue.Empty: return n
+            if not f.set_running_or_notify_cancel(): continue
+            try: f.set_result(fn(*a))
+            except Exception as e: f.set_exception(e)
+            n+=1
+
+    # ── Mutations: each one is an Op whose do/undo hold the exact records touched ──
+    def _apply(self, label, do, undo):
+        with self._lock:
+            r=do(); op=Op(label,do,undo); self._undo.append(op); self._redo.clear()
+            self.rev+=1; self.save_data()
+        self._emit(op,"do"); return r
+    def undo(self):
+        """Revert the newest operation in O(1); returns it, or None if there is nothing to undo."""
+        with self._lock:
+            if not self._undo: return None
+            op=self._undo.pop(); op.undo(); self._redo.append(op); self.rev+=1; self.save_data()
+        self._emit(op,"undo"); return op
+    def redo(self):
+        with self._lock:
+            if not self._redo: return None
+            op=self._redo.pop(); op.do(); self._undo.append(op); self.rev+=1; self.save_data()
+        self._emit(op,"redo"); return op
+    def history(self, n=8):
+        """(undoable newest-first, redoable next-first) operations."""
+        return list(self._undo)[-n:][::-1], self._redo[-n:][::-1]
+    def _emit(self, op, how):
+        for cb in list(self.listeners): cb(op,how)
+
+    @staticmethod
+    def _unlink(lst, rec, hint=None):
+        """Remove rec by identity; O(1) when it is last or still at its recorded index. Returns its index."""
+        if lst and lst[-1] is rec: lst.pop(); return len(lst)
+        if hint is not None and hint<len(lst) and lst[hint] is rec: del lst[hint]; return hint
+        for i,x in enumerate(lst):   # only after an external merge reshuffled the list
+            if x is rec: del lst[i]; return i
+        return None
+    def _index(self, rec, add):
+        if self._tidx is None or rec.get("action")!="taken": return
+        recs=self._tidx[(rec["med_id"],rec["date"])]
+        if add: recs.append(rec)
+        elif rec in recs: recs.remove(rec)
+
+    def replace_data(self, data, label="Replaced all data"):
+        for k in RECORD_KEYS: data.setdefault(k,[])
+        old=self.data
+        def swap(d):
+            def f(): self.data=d; self._tidx=self._sidx=None; self.impact.invalidate()
+            return f
+        self._apply(label,swap(data),swap(old))
+
+    def add_med(self, d):
+        d.setdefault("id",str(uuid.uuid4())); d.setdefault("created",datetime.now().isoformat()); d.setdefault("active",True)
+        meds=lambda:self.data["medications"]
+        self._apply(f"Added {d.get('name','medication')}",lambda:meds().append(d),lambda:self._unlink(meds(),d))
+    def update_med(self, mid, upd):
+        m=self.get_med(mid)
+        if not m: return
+        before={k:m[k] for k in upd if k in m}; missing=[k for k in upd if k not in m]; after=dict(upd)
+        def undo():
+            m.update(before)
+            for k in missing: m.pop(k,None)
+        self._apply(f"Edited {m.get('name','medication')}",lambda:m.update(after),undo)
+    def delete_med(self, mid):
+        """Delete a medication and its dose history (both come back on undo)."""
+        m=self.get_med(mid)
+        if not m: return
+        pos=[None]; logs=[(i,l) for i,l in enumerate(self.data["med_log"]) if l["med_id"]==mid]
+        def do():
+            pos[0]=self._unlink(self.data["medications"],m)
+            if logs: self.data["med_log"]=[l for l in self.data["med_log"] if l["med_id"]!=mid]; self._tidx=None
+        def undo():
+            self.data["medications"].insert(min(pos[0] or 0,len(self.data["medications"])),m)
+            for i,l in logs: self.data["med_log"].insert(min(i,len(self.data["med_log"])),l)
+            if logs: self._tidx=None
+        self._apply(f"Deleted {m.get('name','medication')}",do,undo)
+
+    def _supply_op(self, med, delta):
+        # Returns (do, undo) that move supply by delta and put the exact previous value back
+        prev=[None]
+        def do():
+            if med and med.get("supply") is not None:
+                prev[0]=med["supply"]; med["supply"]=max(0,med["supply"]+delta) if delta<0 else med["supply"]+delta
+        def undo():
+            if med and prev[0] is not None: med["supply"]=prev[0]
+        return do,undo
+    def log_taken(self, mid, name):
+        now=datetime.now(); rec={"med_id":mid,"med_name":name,"date":now.strftime("%Y-%m-%d"),"time":now.strftime("%H:%M:%S"),"action":"taken"}
+        sdo,sundo=self._supply_op(self.get_med(mid),-1)
+        def do(): self.data["med_log"].append(rec); self._index(rec,True); sdo()
+        def undo(): self._unlink(self.data["med_log"],rec); self._index(rec,False); sundo()
+        self._apply(f"Took {name}",do,undo)
+    def undo_taken(self, mid, date=None):
+        date=date or datetime.now().strftime("%Y-%m-%d")
+        recs=self._taken().get((mid,date))
+        if not recs: return
+        rec=recs[-1]; pos=[None]; sdo,sundo=self._supply_op(self.get_med(mid),+1)
+        def do(): pos[0]=self._unlink(self.data["med_log"],rec,pos[0]); self._index(rec,False); sdo()   # redo reuses the index
+        def undo():
+            self.data["med_log"].insert(min(pos[0] if pos[0] is not None else len(self.data["med_log"]),len(self.data["med_log"])),rec)
+            self._index(rec,True); sundo()
+        self._apply(f"Un-took {rec.get('med_name','dose')}",do,undo)
+
+    def log_sleep(self, entry, replace=False):
+        """Add a sleep session. Sessions it overlaps raise SleepOverlap, or are removed when replace=True."""
+        entry.setdefault("logged_at",datetime.now().isoformat())
+        if not migrate_sleep(entry,self.day_boundary): raise ValueError("sleep entry needs start/end or date/bedtime/waketime")
+        clash=self.sessions_between(entry["start"],entry["end"])
+        if clash and not replace: raise SleepOverlap(clash)
+        removed=[]; nights=sorted({night_of(sleep_span(x)[0],self.day_boundary) for x in (entry,*clash)})
+        def fold(change):
+            # FactorImpact counts nights, so swap each touched night's summary before/after the change
+            before=[self.impact_night(d) for d in nights]; change()   # impact_night() also builds the index
+            for d,b in zip(nights,before): self.impact.apply(b,self.impact_night(d))
+        def _do():
+            lst=self.data["sleep_log"]; idx=self._sidx
+            removed[:]=[(self._unlink(lst,o),o) for o in clash]
+            lst.append(entry)
+            for o in clash: idx.remove(o)
+            idx.add(entry)
+        def _undo():
+            lst=self.data["sleep_log"]; idx=self._sidx; self._unlink(lst,entry)
+            for i,o in reversed(removed): lst.insert(min(i if i is not None else len(lst),len(lst)),o)
+            idx.remove(entry)
+            for o in clash: idx.add(o)
+        self._apply(f"Logged sleep {entry['date']}",lambda:fold(_do),lambda:fold(_undo))
+    def add_sleep_batch(self, entries, label=None):
+        """Append many sessions as one undoable step, skipping any that overlap what is already logged
+        (or an earlier entry in the batch). Returns how many were added."""
+        idx=self._sleep(); added=[]
+        for e in entries:
+            if migrate_sleep(e,self.day_boundary) and not idx.between(e["start"],e["end"]): idx.add(e); added.append(e)
+        for e in added: idx.remove(e)   # re-added by do() so undo/redo stay symmetric
+        if not added: return 0
+        def do():
+            self.data["sleep_log"].extend(added); self.impact.invalidate()
+            if self._sidx is not None:
+                for e in added: self._sidx.add(e)
+        def undo():
+            lst=self.data["sleep_log"]
+            for e in reversed(added): self._unlink(lst,e)
+            if self._sidx is not None:
+                for e in added: self._sidx.remove(e)
+            self.impact.invalidate()
+        self._apply(label or f"Imported {len(added)} sleeps",do,undo); return len(added)
+    def factor_impact(self):
+        with self._lock: return self.impact.results(self.impact_nights())
+    def make_session(self, start, end, quality=4, factors=(), notes=""):
+        """Scored sleep_log entry for start..end (datetimes), filed under night_of(start)."""
+        start=start.replace(second=0,microsecond=0); end=end.replace(second=0,microsecond=0)
+        dur=int((end-start).total_seconds()//60)
+        if dur<=0 or dur>MAX_SLEEP_MIN: raise ValueError("Check your times.")
+        q=max(1,min(5,int(quality))); rbt=[s.get("bedtime") for _,s in self.sleep_for_range(7) if s]
+        return {"id":str(uuid.uuid4()),"date":night_of(start,self.day_boundary),"start":start.strftime(SPAN_FMT),"end":end.strftime(SPAN_FMT),
+                "bedtime":start.strftime("%H:%M"),"waketime":end.strftime("%H:%M"),"duration_min":dur,
+                "quality":q,"factors":list(factors),"notes":notes,"score":self.calc_sleep_score(dur,q,rbt)}
+    def make_sleep_entry(self, date, bedtime, waketime, quality=4, factors=(), notes=""):
+        """Session ending at waketime on date (the day you woke up), starting at the latest bedtime before it."""
+        end=datetime.strptime(f"{date} {waketime}","%Y-%m-%d %H:%M"); bh,bm=map(int,bedtime.split(":"))
+        start=end.replace(hour=bh,minute=bm)
+        if start>=end: start-=timedelta(days=1)
+        return self.make_session(start,end,quality,factors,notes)
+
     @staticmethod
     def calc_sleep_score(dur_min, quality, recent_bedtimes=None):
         dur_s=40*math.exp(-0.5*((dur_min-480)/90)**2)
@@ -229,6 +719,545 @@ class DataManager:
                 con_s=max(0,20-var**0.5/6)
         return int(min(100,max(0,dur_s+qual_s+con_s)))
 
+# ==============================================================================
+#  SECTION 4B : LOCAL HTTP API  (127.0.0.1 only, opt-in from Settings)
+# ==============================================================================
+class _ApiError(Exception):
+    """Raised inside a queued API write to answer with a specific HTTP status."""
+    def __init__(self, code, msg): super().__init__(msg); self.code=code
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    server_version="PST/2.0"
+    def log_message(self, *a): pass
+
+    def _send(self, code, obj):
+        body=json.dumps(obj,ensure_ascii=False).encode("utf-8")
+        self.send_response(code); self.send_header("Content-Type","application/json; charset=utf-8")
+        self.send_header("Content-Length",str(len(body))); self.end_headers(); self.wfile.write(body)
+    def _authorised(self):
+        # Host check defeats DNS rebinding; the token is always required, so a web page cannot call in blind
+        port=self.server.api.port; host=(self.headers.get("Host") or "").lower()
+        if host not in ("127.0.0.1","localhost",f"127.0.0.1:{port}",f"localhost:{port}"):
+            self._send(403,{"error":"bad host"}); return False
+        tok=self.server.api.token
+        if not tok or not hmac.compare_digest(self.headers.get("X-PST-Token") or "",tok): self._send(401,{"error":"bad token"}); return False
+        return True
+    def _days(self, q):
+        try: return max(1,min(3650,int(q.get("days",["14"])[0])))
+        except ValueError: return 14
+
+    def do_GET(self):
+        if not self._authorised(): return
+        u=urlparse(self.path); q=parse_qs(u.query); v=self.server.api.dm.snapshot()
+        if u.path=="/api/status":
+            today=datetime.now().strftime("%Y-%m-%d"); yday=(datetime.now()-timedelta(days=1)).strftime("%Y-%m-%d")
+            meds=[{"id":m["id"],"name":m["name"],"dosage":m.get("dosage",""),"supply":m.get("supply"),
+                   "taken":v.taken_today(m["id"])} for m in v.meds]
+            self._send(200,{"date":today,"meds":meds,"taken":sum(m["taken"] for m in meds),"total":len(meds),
+                            "last_sleep":v.get_sleep(today) or v.get_sleep(yday),
+                            "pill_streak":v.pill_streak(),"sleep_streak":v.sleep_streak()})
+        elif u.path=="/api/meds": self._send(200,v.all_meds)
+        elif u.path=="/api/adherence": self._send(200,[{"date":d,"ratio":r} for d,r in v.adherence_for_range(self._days(q))])
+        elif u.path=="/api/sleep": self._send(200,[{"date":d,"entry":s} for d,s in v.sleep_for_range(self._days(q))])
+        elif u.path=="/api/sessions":
+            now=datetime.now(); self._send(200,v.sessions_between(now-timedelta(days=self._days(q)),now+timedelta(days=1)))
+        else: self._send(404,{"error":"not found"})
+
+    def do_POST(self):
+        if not self._authorised(): return
+        if self.headers.get_content_type()!="application/json": self._send(415,{"error":"Content-Type must be application/json"}); return
+        try:
+            n=int(self.headers.get("Content-Length") or 0)
+            body=json.loads(self.rfile.read(n) or b"{}")
+            if not isinstance(body,dict): raise ValueError
+        except ValueError: self._send(400,{"error":"body must be a JSON object"}); return
+        dm=self.server.api.dm; path=urlparse(self.path).path
+        if path in ("/api/take","/api/undo"):
+            key=str(body.get("med_id") or body.get("name") or "").lower()
+            def _dose():
+                # Checked on the UI thread with the write, so concurrent requests cannot both pass
+                med=next((m for m in dm.meds if m["id"].lower()==key or m["name"].lower()==key),None)
+                if not med: raise _ApiError(404,"no such active medication")
+                done=dm.taken_today(med["id"])
+                if path=="/api/take":
+                    if done: raise _ApiError(409,f"{med['name']} already taken today")
+                    dm.log_taken(med["id"],med["name"])
+                else:
+                    if not done: raise _ApiError(409,f"{med['name']} not taken today")
+                    dm.undo_taken(med["id"])
+                return {"id":med["id"],"name":med["name"],"taken":path=="/api/take","supply":med.get("supply")}
+            fut=dm.submit(_dose)
+        elif path=="/api/sleep":
+            now=datetime.now(); extra=(body.get("quality",4),body.get("factors",[]),body.get("notes",""))
+            # Checked here, not left to make_session: a string would be stored as a list of characters,
+            # and every unknown factor name becomes a FactorImpact column
+            if type(extra[0]) is not int or not 1<=extra[0]<=5: self._send(400,{"error":"quality must be an integer 1-5"}); return
+            if not isinstance(extra[1],list) or not all(f in SLEEP_FACTORS for f in extra[1]):
+                self._send(400,{"error":f"factors must be a list drawn from {SLEEP_FACTORS}"}); return
+            if not isinstance(extra[2],str): self._send(400,{"error":"notes must be a string"}); return
+            def _log():
+                if "start" in body:
+                    e=dm.make_session(datetime.fromisoformat(body["start"]),datetime.fromisoformat(body.get("end") or now.isoformat()),*extra)
+                else: e=dm.make_sleep_entry(body.get("date",now.strftime("%Y-%m-%d")),body["bedtime"],body.get("waketime",now.strftime("%H:%M")),*extra)
+                dm.log_sleep(e,bool(body.get("replace"))); return dict(e)
+            fut=dm.submit(_log)
+        else: self._send(404,{"error":"not found"}); return
+        try:
+            try: res=fut.result(timeout=10)
+            except FutureTimeout:
+                # Still queued: withdraw it so a client retry cannot apply the write twice
+                if fut.cancel(): self._send(503,{"error":"widget busy, nothing was changed"}); return
+                res=fut.result()   # already running on the UI thread; report its real outcome
+        except _ApiError as e: self._send(e.code,{"error":str(e)}); return
+        except SleepOverlap as e: self._send(409,{"error":f"{e}; send \"replace\": true to overwrite"}); return
+        except (KeyError, ValueError, TypeError) as e: self._send(400,{"error":f"invalid field: {e}"}); return
+        except Exception as e: self._send(500,{"error":f"write failed: {e!r}"}); return
+        self._send(200,{"ok":True,"result":res})
+
+class ApiServer:
+    """Threaded JSON server: reads use DataManager snapshots, writes go through its mutation queue."""
+    def __init__(self, dm, port=8765, token=""):
+        self.dm=dm; self.port=port; self.token=token; self._srv=None
+    def start(self):
+        self._srv=ThreadingHTTPServer(("127.0.0.1",self.port),_ApiHandler); self._srv.daemon_threads=True
+        self._srv.api=self; threading.Thread(target=self._srv.serve_forever,daemon=True).start()
+    def stop(self):
+        if self._srv:
+            self._srv.shutdown(); self._srv.server_close(); self._srv=None
+
+# ==============================================================================
+#  SECTION 4C : BACKUPS  (gzip full snapshots + record-level deltas)
+# ==============================================================================
+class BackupManager:
+    """Rotating backups in DATA_DIR/backups. A delta holds only the record lines added/removed since the
+    previous backup point; manifest.json records a checksum per file and per rebuilt state."""
+    def __init__(self, dm, folder=BACKUP_DIR):
+        self.dm=dm; self.dir=folder; self.dir.mkdir(parents=True,exist_ok=True)
+        self._mf=folder/"manifest.json"; m=DataManager._load(self._mf,[])
+        self.entries=m if isinstance(m,list) else []; self._cache=None; self._last=0.0
+
+    @staticmethod
+    def _state_hash(lines, extras):
+        h=hashlib.sha256()
+        for k in RECORD_KEYS:
+            for l in sorted(lines[k]): h.update(l.encode("utf-8")+b"\n")
+            h.update(b"\0")
+        h.update(json.dumps(extras,sort_keys=True).encode("utf-8")); return h.hexdigest()
+    def _current(self):
+        with self.dm._lock:
+            _,lines=self.dm._dump_records(self.dm.data)
+            extras=json.loads(json.dumps({k:v for k,v in self.dm.data.items() if k not in RECORD_KEYS}))
+        return lines,extras
+
+    def _put(self, kind, payload, state, counts, base=None):
+        ts=datetime.now(); name=f"{kind}-{ts:%Y%m%d-%H%M%S-%f}.json.gz"
+        raw=gzip.compress(json.dumps(payload,ensure_ascii=False).encode("utf-8"))
+        tmp=self.dir/(name+".tmp"); tmp.write_bytes(raw); tmp.replace(self.dir/name)
+        self.entries.append({"file":name,"kind":kind,"ts":ts.isoformat(timespec="seconds"),"base":base or name,
+                             "sha256":hashlib.sha256(raw).hexdigest(),"state":state,"counts":counts,"bytes":len(raw)})
+        DataManager._write(self._mf,self.entries)
+    def _read(self, e):
+        raw=(self.dir/e["file"]).read_bytes()
+        if hashlib.sha256(raw).hexdigest()!=e["sha256"]: raise ValueError(f"{e['file']}: checksum mismatch")
+        return json.loads(gzip.decompress(raw))
+
+    def _full_due(self, full):
+        s=self.dm.settings; since=[e for e in self.entries if e["base"]==full["file"] and e["kind"]=="delta"]
+        age=datetime.now()-datetime.fromisoformat(full["ts"])
+        return (age>=timedelta(days=s["backup_full_days"]) or len(since)>=200
+                or sum(e["bytes"] for e in since)>full["bytes"])   # keep restore cost bounded
+
+    def checkpoint(self, force_full=False):
+        """Record the current data as a new backup point; returns "full", "delta" or None if unchanged."""
+        lines,extras=self._current(); state=self._state_hash(lines,extras)
+        last=self.entries[-1] if self.entries else None
+        if last and last["state"]==state and not force_full: return None
+        counts={k:len(lines[k]) for k in RECORD_KEYS}
+        full=next((e for e in reversed(self.entries) if e["kind"]=="full"),None)
+        prev=None
+        if full and not force_full and not self._full_due(full):
+            try: prev=self.rebuild(last)
+            except (OSError, ValueError, KeyError): prev=None
+        if prev is None: self._put("full",{"lines":lines,"extras":extras},state,counts)
+        else:
+            add={}; rem={}
+            for k in RECORD_KEYS:
+                a=Counter(lines[k]); b=Counter(prev[0][k])
+                add[k]=list((a-b).elements()); rem[k]=list((b-a).elements())
+            self._put("delta",{"add":add,"del":rem,"extras":extras},state,counts,full["file"])
+        self._cache=(self.entries[-1]["file"],lines,extras); self._prune()
+        return self.entries[-1]["kind"]
+    def maybe_checkpoint(self):
+        if time.monotonic()-self._last<self.dm.settings["backup_interval_min"]*60: return None
+        self._last=time.monotonic()
+        try: return self.checkpoint()
+        except (OSError, ValueError): return None
+
+    def rebuild(self, e):
+        """(lines, extras) as of backup point e, verified against the manifest checksums."""
+        if self._cache and self._cache[0]==e["file"]: return self._cache[1],self._cache[2]
+        i=self.entries.index(e); start=next(j for j in range(i,-1,-1) if self.entries[j]["file"]==e["base"])
+        chain=[x for x in self.entries[start:i+1] if x["base"]==e["base"]]
+        p=self._read(chain[0]); lines={k:list(p["lines"][k]) for k in RECORD_KEYS}; extras=p["extras"]
+        for d in chain[1:]:
+            p=self._read(d)
+            for k in RECORD_KEYS:
+                rm=Counter(p["del"][k]); left=Counter(p["add"][k]); adds={}
+                for l in p["add"][k]: adds.setdefault(DataManager._rec_key(k,json.loads(l),l),l)
+                out=[]
+                for l in lines[k]:
+                    if not rm[l]: out.append(l); continue
+                    rm[l]-=1; key=DataManager._rec_key(k,json.loads(l),l)
+                    if key in adds: a=adds.pop(key); out.append(a); left[a]-=1   # edited record keeps its position
+                for l in p["add"][k]:   # multiset: identical med_log lines are separate doses
+                    if left[l]>0: out.append(l); left[l]-=1
+                lines[k]=out
+            extras=p["extras"]
+        if self._state_hash(lines,extras)!=e["state"]: raise ValueError(f"{e['file']}: rebuilt state does not match")
+        return lines,extras
+    def restore(self, e):
+        lines,extras=self.rebuild(e)
+        data={k:[json.loads(l) for l in lines[k]] for k in RECORD_KEYS}; data.update(extras); return data
+    def recover_latest(self):
+        """Newest backup point that still verifies, as (entry, data), or (None, None)."""
+        for e in reversed(self.entries):
+            try: return e,self.restore(e)
+            except (OSError, ValueError, KeyError, StopIteration): continue
+        return None,None
+
+    def _prune(self):
+        s=self.dm.settings; fulls=[e for e in self.entries if e["kind"]=="full"]
+        cutoff=(datetime.now()-timedelta(days=s["backup_keep_days"])).isoformat(timespec="seconds")
+        drop={f["file"] for i,f in enumerate(fulls[:-1]) if len(fulls)-i>s["backup_keep_full"] or fulls[i+1]["ts"]<cutoff}
+        if not drop: return
+        for e in self.entries:
+            if e["base"] in drop:
+                try: (self.dir/e["file"]).unlink()
+                except OSError: pass
+        self.entries=[e for e in self.entries if e["base"] not in drop]; DataManager._write(self._mf,self.entries)
+
+# ==============================================================================
+#  SECTION 4D : SLEEP FACTOR IMPACT
+# ==============================================================================
+class FactorImpact:
+    """Effect of each sleep factor and factor pair on duration, quality and score over every night (DataView.impact_nights).
+    Factors are bitmask-encoded and running sums (n, sum, sum of squares) are kept per combination, so
+    log_sleep updates the cache in O(combinations) instead of rescanning history."""
+    METRICS=("duration_min","quality","score")
+    MIN_N=5
+    MIN_NIGHT_MIN=180   # shorter nights are nap-only days
+    def __init__(self): self.names=list(SLEEP_FACTORS); self._n=None
+
+    def invalidate(self): self._n=None
+    def _mask(self, factors):
+        m=0
+        for f in factors or ():
+            if f not in self.names: self.names.append(f); self._n=None   # new factor: combos change, rebuild
+            m|=1<<self.names.index(f)
+        return m
+    def _combos(self):
+        k=len(self.names); c=[((self.names[i],),1<<i) for i in range(k)]
+        c+=[((self.names[i],self.names[j]),(1<<i)|(1<<j)) for i in range(k) for j in range(i+1,k)]
+        return c
+    @classmethod
+    def _vals(cls, s): return [float(s[m]) if isinstance(s.get(m),(int,float)) else np.nan for m in cls.METRICS]
+
+    def rebuild(self, entries):
+        masks=np.array([self._mask(s.get("factors")) for s in entries],dtype=np.int64)
+        self.combos=self._combos(); self._bits=np.array([b for _,b in self.combos],dtype=np.int64)
+        vals=np.array([self._vals(s) for s in entries],dtype=float).reshape(len(entries),len(self.METRICS))
+        ok=~np.isnan(vals); v=np.where(ok,vals,0.0)
+        W=((masks[:,None]&self._bits[None,:])==self._bits).astype(float)   # nights x combos
+        self._n=W.T@ok; self._s=W.T@v; self._q=W.T@(v*v)
+        self._tn=ok.sum(0).astype(float); self._ts=v.sum(0); self._tq=(v*v).sum(0)
+    def apply(self, old, new):
+        """Fold a replaced (old) and/or added (new) sleep entry into the running sums."""
+        if self._n is None: return
+        for s,sign in ((old,-1.0),(new,1.0)):
+            if not s: continue
+            m=self._mask(s.get("factors"))
+            if self._n is None: return
+            x=np.array(self._vals(s)); ok=~np.isnan(x); v=np.where(ok,x,0.0)
+            w=((m&self._bits)==self._bits).astype(float)
+            self._n+=sign*np.outer(w,ok); self._s+=sign*np.outer(w,v); self._q+=sign*np.outer(w,v*v)
+            self._tn+=sign*ok; self._ts+=sign*v; self._tq+=sign*v*v
+
+    def results(self, entries):
+        """One dict per factor/pair: n with and without, and (diff, 95% CI half-width) per metric."""
+        if self._n is None: self.rebuild(entries)
+        n1=self._n; n0=self._tn-n1
+        with np.errstate(divide="ignore",invalid="ignore"):
+            m1=self._s/n1; m0=(self._ts-self._s)/n0
+            v1=np.maximum(self._q-n1*m1**2,0)/(n1-1); v0=np.maximum((self._tq-self._q)-n0*m0**2,0)/(n0-1)
+            ci=1.96*np.sqrt(v1/n1+v0/n0)   # Welch normal approximation
+        ok=(n1>=self.MIN_N)&(n0>=self.MIN_N); out=[]
+        for j,(fs,_) in enumerate(self.combos):
+            r={"factors":fs,"label":" + ".join(fs),"n":int(n1[j,2]),"n_without":int(n0[j,2]),"ok":bool(ok[j,2])}
+            for k,m in enumerate(self.METRICS):
+                r[m]=(float(m1[j,k]-m0[j,k]),float(ci[j,k])) if ok[j,k] else None
+            out.append(r)
+        return out
+    @staticmethod
+    def insight(r):
+        d,ci=r["score"]; verb="costs you" if d<0 else "adds"
+        return f"{r['label']} {verb} ~{abs(d):.0f} point{'s' if round(abs(d))!=1 else ''} (n={r['n']}, ±{ci:.0f})"
+
+# ==============================================================================
+#  SECTION 4E : EVENT-LOOP WATCHDOG
+# ==============================================================================
+class Watchdog:
+    """Heartbeat on the Tk loop plus a helper thread that snapshots the main thread's stack when the
+    heartbeat stops for longer than stall_ms. Finished stalls go to a rotating JSON-lines log."""
+    INTERVAL=0.1
+    DISPATCH=("_go",)   # thin routers (Sidebar._go -> App._nav): the handler is the frame they call
+    def __init__(self, root, stall_ms=250):
+        self.root=root; self.stall_ms=stall_ms; self.lags=deque(maxlen=600); self.stalls=0
+        self._beat=time.monotonic(); self._done=queue.Queue(); self._main=threading.get_ident(); self._run=True
+        self.log=logging.getLogger("pst.stalls"); self.log.propagate=False; self.log.setLevel(logging.INFO)
+        if not self.log.handlers:
+            h=logging.handlers.RotatingFileHandler(STALL_LOG,maxBytes=256*1024,backupCount=3,encoding="utf-8")
+            h.setFormatter(logging.Formatter("%(message)s")); self.log.addHandler(h)
+        self.root.after(int(self.INTERVAL*1000),self._hb)
+        threading.Thread(target=self._watch,daemon=True).start()
+    def stop(self): self._run=False
+
+    def _hb(self):
+        now=time.monotonic(); lag=max(0.0,now-self._beat-self.INTERVAL)
+        self.lags.append(lag*1000)
+        if lag*1000>=self.stall_ms: self._done.put(lag*1000)   # queued before the beat moves, see _watch
+        self._beat=now
+        if self._run: self.root.after(int(self.INTERVAL*1000),self._hb)
+
+    def _capture(self):
+        frame=sys._current_frames().get(self._main)
+        if frame is None: return None
+        st=traceback.extract_stack(frame)
+        ours=[f for f in st if f.filename==__file__ and f.name not in ("<module>","<lambda>","mainloop")]
+        while len(ours)>1 and ours[0].name in self.DISPATCH: ours.pop(0)
+        return {"handler":ours[0].name if ours else st[-1].name,
+                "at":f"{ours[-1].name}:{ours[-1].lineno}" if ours else f"{Path(st[-1].filename).name}:{st[-1].lineno}",
+                "stack":[f"{Path(f.filename).name}:{f.lineno} {f.name}" for f in st[-15:]]}
+    def _watch(self):
+        cur=None; at=None
+        while self._run:
+            time.sleep(0.03); beat=self._beat
+            # Same lag measure as _hb, so a captured stack always belongs to the stall _hb reports
+            if cur is None and (time.monotonic()-beat-self.INTERVAL)*1000>=self.stall_ms:
+                cur=self._capture() or {"handler":"?","at":"?","stack":[]}; at=beat
+            try: ms=self._done.get_nowait()
+            except queue.Empty:
+                if cur is not None and beat!=at: cur=None   # heartbeat resumed without a reported stall
+                continue
+            rec={"ts":datetime.now().isoformat(timespec="seconds"),"ms":round(ms)}
+            rec.update(cur or {"handler":"?","at":"?","stack":[]}); cur=None; self.stalls+=1
+            try: self.log.info(json.dumps(rec))
+            except Exception: pass
+
+    def lag_stats(self):
+        """(median, p95, max) heartbeat lag in ms over the last minute."""
+        xs=sorted(self.lags)
+        if not xs: return 0.0,0.0,0.0
+        return xs[len(xs)//2],xs[min(len(xs)-1,int(len(xs)*0.95))],xs[-1]
+    @staticmethod
+    def read_log():
+        recs=[]
+        for p in sorted(DATA_DIR.glob(STALL_LOG.name+"*"),reverse=True):   # oldest rotated file first
+            try:
+                for ln in p.read_text(encoding="utf-8").splitlines():
+                    try: recs.append(json.loads(ln))
+                    except ValueError: pass
+            except OSError: pass
+        return recs
+    def summary(self):
+        med,p95,mx=self.lag_stats(); recs=self.read_log()
+        lines=[f"Loop lag (last min): median {med:.0f} ms, p95 {p95:.0f} ms, max {mx:.0f} ms",
+               f"Stalls over {self.stall_ms} ms: {self.stalls} this session, {len(recs)} logged"]
+        by=defaultdict(list)
+        for r in recs: by[r.get("handler","?")].append(r.get("ms",0))
+        for h,ms in sorted(by.items(),key=lambda x:-sum(x[1]))[:5]:
+            lines.append(f"  {h}: {len(ms)}x, worst {max(ms)} ms, total {sum(ms)/1000:.1f} s")
+        for r in recs[-3:][::-1]: lines.append(f"  last: {r['ts'].replace('T',' ')}  {r['ms']} ms in {r.get('handler')} ({r.get('at')})")
+        return "\n".join(lines)
+
+# ==============================================================================
+#  SECTION 4F : SLEEP IMPORT  (Apple Health export.xml/.zip, Fitbit & Google CSV/JSON)
+# ==============================================================================
+APPLE_ASLEEP=("HKCategoryValueSleepAnalysisAsleep","HKCategoryValueSleepAnalysisAsleepUnspecified",
+              "HKCategoryValueSleepAnalysisAsleepCore","HKCategoryValueSleepAnalysisAsleepDeep","HKCategoryValueSleepAnalysisAsleepREM")
+APPLE_DEEP=("HKCategoryValueSleepAnalysisAsleepDeep","HKCategoryValueSleepAnalysisAsleepREM")
+
+class _Counted(io.RawIOBase):
+    """Read-through wrapper that counts bytes so long imports can report progress."""
+    def __init__(self, f, tick): self.f=f; self.tick=tick
+    def readable(self): return True
+    def readinto(self, b):
+        d=self.f.read(len(b)); b[:len(d)]=d; self.tick(len(d)); return len(d)
+
+def _parse_dt(v):
+    """Wall-clock datetime from the timestamp styles wearables export (ISO, Apple, Fitbit 12h).
+    Offset-aware stamps (Google Fit "...Z", Apple "-0800") are converted to local time, like the millis path."""
+    v=str(v).strip().replace("Z","+00:00")
+    for fmt in ("%Y-%m-%d %H:%M:%S %z","%Y-%m-%d %I:%M%p","%Y-%m-%d %I:%M %p","%m/%d/%Y %H:%M","%m/%d/%Y %I:%M %p"):
+        try: d=datetime.strptime(v,fmt); break
+        except ValueError: pass
+    else: d=datetime.fromisoformat(v)
+    return d.astimezone().replace(tzinfo=None) if d.tzinfo else d
+def _quality(eff=None, deep=None):
+    """1-5 quality from sleep efficiency (%) or the deep+REM share of time asleep."""
+    if eff is not None: return 5 if eff>=93 else 4 if eff>=87 else 3 if eff>=80 else 2 if eff>=70 else 1
+    if deep is not None: return 5 if deep>=.45 else 4 if deep>=.35 else 3 if deep>=.25 else 2 if deep>=.15 else 1
+    return 3
+def _num(v):
+    try: return float(v)
+    except (TypeError, ValueError): return None
+
+def iter_apple_health(f, gap_min=60):
+    """Sleep sessions from an Apple Health export.xml stream. Stage records (asleep/core/deep/REM/in bed)
+    are merged into sessions when less than gap_min apart; only a two-day window is held in memory."""
+    open_=[]   # [start, end, asleep_min, deep_min, inbed_only]
+    def flush(before=None):
+        while open_ and (before is None or open_[0][1]<before):
+            a,b,asl,dp,inbed=open_.pop(0)
+            yield {"start":a,"end":b,"quality":_quality(deep=dp/asl if asl and not inbed else None),"source":"Apple Health"}
+    root=None
+    for ev,el in ET.iterparse(f,events=("start","end")):
+        if ev=="start":
+            if root is None: root=el
+            continue
+        if el.tag=="Record" and el.get("type")=="HKCategoryTypeIdentifierSleepAnalysis":
+            try: a=_parse_dt(el.get("startDate")); b=_parse_dt(el.get("endDate"))
+            except (TypeError, ValueError): a=b=None
+            val=el.get("value",""); mins=(b-a).total_seconds()/60 if a and b else 0
+            if mins>0:
+                asleep=val in APPLE_ASLEEP; hit=None
+                for o in open_:
+                    if a<=o[1]+timedelta(minutes=gap_min) and b>=o[0]-timedelta(minutes=gap_min): hit=o; break
+                if hit is None: hit=[a,b,0.0,0.0,True]; open_.append(hit); open_.sort(key=lambda o:o[0])
+                else: hit[0]=min(hit[0],a); hit[1]=max(hit[1],b)
+                if asleep: hit[2]+=mins; hit[3]+=mins if val in APPLE_DEEP else 0; hit[4]=False
+                yield from flush(a-timedelta(days=2))
+        if el.tag!="HealthData": el.clear()
+        if root is not None and el.tag in ("Record","Workout","ActivitySummary"): root.clear()   # drop finished siblings
+    yield from flush()
+
+def _iter_json(f, chunk=1<<16):
+    """Objects of a top-level JSON array, decoded one at a time from a binary stream; any other JSON
+    document is loaded whole (those are small)."""
+    dec=json.JSONDecoder(); rd=io.TextIOWrapper(f,encoding="utf-8-sig"); buf=rd.read(chunk); pos=0
+    while pos<len(buf) and buf[pos].isspace(): pos+=1
+    if buf[pos:pos+1]!="[":
+        doc=json.loads(buf+rd.read())
+        if isinstance(doc,dict): doc=doc.get("sleep") or doc.get("session") or [doc]   # Fitbit API response / one session
+        yield from (doc if isinstance(doc,list) else [])
+        return
+    pos+=1
+    while True:
+        while True:
+            while pos<len(buf) and buf[pos] in " \t\r\n,": pos+=1
+            if pos<len(buf): break
+            buf=rd.read(chunk); pos=0
+            if not buf: return
+        if buf[pos]=="]": return
+        try: obj,end=dec.raw_decode(buf,pos)
+        except ValueError:
+            more=rd.read(chunk)
+            if not more: raise
+            buf=buf[pos:]+more; pos=0; continue
+        yield obj; pos=end
+        if pos>chunk: buf=buf[pos:]; pos=0
+
+def _json_session(o):
+    """Fitbit sleep log, Fitbit/Google Fit session, or None for anything that is not sleep."""
+    if not isinstance(o,dict): return None
+    if "startTime" in o and ("dateOfSleep" in o or "minutesAsleep" in o):   # Fitbit
+        a=_parse_dt(o["startTime"]); b=_parse_dt(o["endTime"]) if o.get("endTime") else a+timedelta(milliseconds=o.get("duration",0))
+        lv=(o.get("levels") or {}).get("summary") or {}; asl=_num(o.get("minutesAsleep"))
+        deep=sum((lv.get(k) or {}).get("minutes",0) for k in ("deep","rem"))
+        eff=_num(o.get("efficiency")); q=_quality(eff=eff) if eff is not None else _quality(deep=deep/asl if asl and deep else None)
+        return {"start":a,"end":b,"quality":q,"source":"Fitbit"}
+    act=str(o.get("activity") or o.get("activityType") or o.get("fitnessActivity") or "").lower()
+    if "sleep" in act or act=="72":                                                    # Google Fit session
+        if "startTime" in o: a,b=_parse_dt(o["startTime"]),_parse_dt(o["endTime"])
+        else: a,b=(datetime.fromtimestamp(int(o[k])/1000) for k in ("startTimeMillis","endTimeMillis"))
+        return {"start":a,"end":b,"quality":3,"source":"Google Fit"}
+    return None
+
+def _iter_csv(f):
+    """Sleep sessions from a CSV with start/end columns (Fitbit web export, Google Fit, sleep apps)."""
+    rd=csv.DictReader(io.TextIOWrapper(f,encoding="utf-8-sig",newline=""))
+    for row in rd:
+        r={(k or "").strip().lower():v for k,v in row.items()}
+        st=next((r[k] for k in r if "start" in k and r[k]),None); en=next((r[k] for k in r if ("end" in k or "stop" in k) and r[k]),None)
+        if not (st and en): continue
+        try: a,b=_parse_dt(st),_parse_dt(en)
+        except ValueError: continue
+        asl=_num(r.get("minutes asleep")); bed=_num(r.get("time in bed"))
+        deep=sum(_num(r.get(k)) or 0 for k in ("minutes deep sleep","minutes rem sleep"))
+        eff=_num(r.get("efficiency") or r.get("sleep efficiency"))
+        if eff is None and asl and bed: eff=100*asl/bed
+        yield {"start":a,"end":b,"quality":_quality(eff,deep/asl if asl and deep else None),"source":"CSV"}
+
+def _open_member(path, member):
+    z=zipfile.ZipFile(path); f=z.open(member); z.close(); return f   # the open member keeps the archive alive
+
+def _sessions_from(name, f):
+    n=name.lower()
+    if n.endswith(".xml"): return iter_apple_health(f)
+    if n.endswith(".csv"): return _iter_csv(f)
+    return (x for o in _iter_json(f) for x in [_json_session(o)] if x)
+
+class SleepImporter:
+    """Streams sleep sessions out of wearable exports on a worker thread and commits them through
+    DataManager.add_sleep_batch in chunks (one undo step per chunk). Memory stays bounded by the parser
+    window and CHUNK; progress is bytes read across all inputs."""
+    CHUNK=500
+    EXT=(".xml",".json",".csv")
+    def __init__(self, dm, paths):
+        self.dm=dm; self.paths=[Path(p) for p in paths]; self.cancel=threading.Event()
+        self.read=0; self.total=1; self.added=0; self.skipped=0; self.done=False; self.error=None; self.current=""
+    def _inputs(self):
+        """(display name, size, opener) for each file, and each matching member of .zip exports."""
+        out=[]
+        for p in self.paths:
+            if p.suffix.lower()==".zip":
+                with zipfile.ZipFile(p) as z:
+                    for m in z.infolist():
+                        n=m.filename.lower()
+                        if n.endswith(self.EXT) and ("sleep" in n or n.endswith("/export.xml") or n=="export.xml" or "sessions" in n):
+                            out.append((f"{p.name}:{m.filename}",m.file_size,lambda p=p,m=m:_open_member(p,m)))
+            elif p.suffix.lower() in self.EXT: out.append((p.name,p.stat().st_size,lambda p=p:open(p,"rb")))
+        return out
+    def start(self): threading.Thread(target=self.run,daemon=True).start(); return self
+    @property
+    def progress(self): return min(1.0,self.read/self.total)
+
+    def run(self):
+        batch=[]; recent=deque(maxlen=7)   # bedtimes of the preceding imported nights, for calc_sleep_score
+        def tick(n): self.read+=n
+        def commit():
+            if not batch: return
+            n=self.dm.submit(self.dm.add_sleep_batch,list(batch)).result()
+            self.added+=n; self.skipped+=len(batch)-n; batch.clear()
+        try:
+            inputs=self._inputs(); self.total=sum(s for _,s,_ in inputs) or 1
+            for name,_,opener in inputs:
+                self.current=name
+                with opener() as raw:
+                    for x in _sessions_from(name,io.BufferedReader(_Counted(raw,tick))):
+                        if self.cancel.is_set(): return
+                        dur=int((x["end"]-x["start"]).total_seconds()//60)
+                        if not 15<=dur<=MAX_SLEEP_MIN: self.skipped+=1; continue
+                        bt=x["start"].strftime("%H:%M"); q=x["quality"]
+                        batch.append({"id":str(uuid.uuid4()),"date":night_of(x["start"],self.dm.day_boundary),
+                                      "start":x["start"].strftime(SPAN_FMT),"end":x["end"].strftime(SPAN_FMT),"bedtime":bt,
+                                      "waketime":x["end"].strftime("%H:%M"),"duration_min":dur,"quality":q,"factors":[],
+                                      "notes":f"Imported: {x['source']}","score":DataManager.calc_sleep_score(dur,q,list(recent))})
+                        if dur>=180: recent.append(bt)   # naps do not count toward bedtime consistency
+                        if len(batch)>=self.CHUNK: commit()
+            commit()
+        except Exception as e: self.error=f"{self.current}: {type(e).__name__}: {e}"
+        finally: self.done=True
+
 # ==============================================================================
 #  SECTION 5 : CUSTOM WIDGETS
 # ==============================================================================
@@ -275,19 +1304,141 @@ class ChartFrame(ctk.CTkFrame):
         self.canvas=FigureCanvasTkAgg(self.fig,master=self)
         self.canvas.get_tk_widget().configure(bg=T.CHART_BG,highlightthickness=0)
         self.canvas.get_tk_widget().pack(fill="both",expand=True,padx=4,pady=(0,4))
-    def _style(self):
-        ax=self.ax; ax.set_facecolor(T.CHART_BG)
-        ax.tick_params(colors=T.CHART_TICK,labelsize=8)
-        for sp in ("top","right"): ax.spines[sp].set_visible(False)
-        for sp in ("bottom","left"): ax.spines[sp].set_color(T.CHART_GRID)
-        ax.yaxis.label.set_color(T.CHART_TICK); ax.xaxis.label.set_color(T.CHART_TICK)
-        ax.grid(axis="y",color=T.CHART_GRID,linewidth=0.5,alpha=0.5)
+    def _style(self): style_axes(self.ax)
     def redraw(self): self.ax.clear(); self._style()
+    def px(self):
+        """Plot-area width in pixels: the most points worth drawing on this chart."""
+        w=self.canvas.get_tk_widget().winfo_width()
+        return max(100,int((w if w>1 else self.fig.get_figwidth()*self.fig.dpi)*0.8))
     def render(self):
         try: self.fig.tight_layout(pad=0.8)
         except: pass
         self.canvas.draw_idle()
 
+# ==============================================================================
+#  SECTION 5B : CHART RENDERERS  (pure Axes drawing, shared by Stats page and reports)
+# ==============================================================================
+def style_axes(ax):
+    ax.set_facecolor(T.CHART_BG)
+    ax.tick_params(colors=T.CHART_TICK,labelsize=8)
+    for sp in ("top","right"): ax.spines[sp].set_visible(False)
+    for sp in ("bottom","left"): ax.spines[sp].set_color(T.CHART_GRID)
+    ax.yaxis.label.set_color(T.CHART_TICK); ax.xaxis.label.set_color(T.CHART_TICK)
+    ax.grid(axis="y",color=T.CHART_GRID,linewidth=0.5,alpha=0.5)
+def no_data(ax, msg="No data"):
+    ax.text(0.5,0.5,msg,transform=ax.transAxes,ha="center",va="center",color=T.TEXT_MUTED,fontsize=11)
+def date_axis(ax, px):
+    # Sparse date ticks: roughly one label per 60 px whatever the range
+    loc=mdates.AutoDateLocator(minticks=2,maxticks=max(3,int(px)//60))
+    ax.xaxis.set_major_locator(loc); ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(loc))
+    ax.xaxis.get_offset_text().set_color(T.CHART_TICK); ax.xaxis.get_offset_text().set_fontsize(7)
+
+def bin_period(days):
+    """None (daily) up to two months, then weekly, then monthly beyond two years."""
+    return None if days<=62 else "W" if days<=730 else "M"
+def bin_series(dates, vals, period):
+    """Aggregate daily values into weekly/monthly bins -> (bin centres, mean, min, max); empty bins dropped."""
+    groups=defaultdict(list)
+    for d,v in zip(dates,vals):
+        if v is None: continue
+        k=d-timedelta(days=d.weekday()) if period=="W" else d.replace(day=1)
+        groups[k].append(v)
+    xs=sorted(groups); half=timedelta(days=3.5) if period=="W" else timedelta(days=15)
+    return ([datetime.combine(k,datetime.min.time())+half for k in xs],[sum(groups[k])/len(groups[k]) for k in xs],
+            [min(groups[k]) for k in xs],[max(groups[k]) for k in xs])
+def lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets decimation: n points that keep the visual shape of the line."""
+    x=np.asarray(x,dtype=float); y=np.asarray(y,dtype=float); L=len(x)
+    if n>=L or n<3: return x,y
+    every=(L-2)/(n-2); idx=[0]; a=0
+    for i in range(n-2):
+        s=int(i*every)+1; e=int((i+1)*every)+1; ne=min(int((i+2)*every)+1,L)
+        cx=x[e:ne].mean() if ne>e else x[-1]; cy=y[e:ne].mean() if ne>e else y[-1]
+        area=np.abs((x[a]-cx)*(y[s:e]-y[a])-(x[a]-x[s:e])*(cy-y[a]))
+        a=s+int(area.argmax()); idx.append(a)
+    idx.append(L-1); return x[idx],y[idx]
+def _series(pairs, fn):
+    # (dates, values) for the non-empty days of a (date str, entry|None) range
+    ds=[]; vs=[]
+    for d,s in pairs:
+        v=fn(s) if s else None
+        if v is not None: ds.append(datetime.strptime(d,"%Y-%m-%d")); vs.append(v)
+    return ds,vs
+
+def range_stats(sd, adh, has_meds):
+    """Summary figures shown on the Stats cards (and in batch reports) for one range."""
+    se=[s for _,s in sd if s]; scs=[s.get("score",0) for s in se if s.get("score")]
+    return {"nights":len(se),"days":len(sd),
+            "avg_sleep_min":sum(s.get("duration_min",0) for s in se)/len(se) if se else None,
+            "avg_quality":sum(s.get("quality",3) for s in se)/len(se) if se else None,
+            "avg_score":sum(scs)/len(scs) if scs else (0 if se else None),
+            "adherence_pct":sum(v for _,v in adh)/len(adh)*100 if adh and has_meds else None}
+
+def draw_adherence(ax, adh, px):
+    if not adh: no_data(ax); return
+    ds=[datetime.strptime(d,"%Y-%m-%d") for d,_ in adh]; vals=[v*100 for _,v in adh]; per=bin_period(len(adh))
+    if per:
+        ds,vals,lo,hi=bin_series([d.date() for d in ds],vals,per); w=(5 if per=="W" else 22)
+        ax.vlines(mdates.date2num(ds),lo,hi,color=T.TEXT_MUTED,linewidth=0.8,alpha=0.6)
+    else: w=0.6
+    cols=[T.GREEN if v>=100 else T.AMBER if v>=50 else T.RED for v in vals]
+    ax.bar(mdates.date2num(ds),vals,color=cols,width=w,alpha=0.85)
+    ax.set_ylim(0,110); ax.set_ylabel("%",fontsize=9); ax.axhline(y=100,color=T.GREEN,linewidth=0.5,alpha=0.3,linestyle="--")
+    date_axis(ax,px)
+def draw_duration(ax, sd, px):
+    ds,hrs=_series(sd,lambda s:s.get("duration_min",0)/60)
+    if not hrs: no_data(ax); return
+    per=bin_period(len(sd))
+    if per:
+        bx,mean,lo,hi=bin_series([d.date() for d in ds],hrs,per); bn=mdates.date2num(bx)
+        x,y=lttb(mdates.date2num(ds),hrs,int(px))
+        ax.plot(x,y,color=T.PURPLE,linewidth=0.7,alpha=0.35)
+        ax.fill_between(bn,lo,hi,alpha=0.15,color=T.PURPLE,linewidth=0)
+        ax.plot(bn,mean,color=T.PURPLE,linewidth=2,marker="o",markersize=3)
+    else:
+        x=mdates.date2num(ds); ax.fill_between(x,hrs,alpha=0.15,color=T.PURPLE)
+        ax.plot(x,hrs,color=T.PURPLE,linewidth=2,marker="o",markersize=4,markerfacecolor=T.PURPLE)
+    ax.axhspan(7,9,alpha=0.05,color=T.GREEN)
+    ax.set_ylabel("Hours",fontsize=9); ax.set_ylim(0,max(12,max(hrs)+1))
+    ax.set_xlim(mdates.date2num(datetime.strptime(sd[0][0],"%Y-%m-%d"))-0.5,mdates.date2num(datetime.strptime(sd[-1][0],"%Y-%m-%d"))+0.5)
+    date_axis(ax,px)
+def draw_quality(ax, sd, px):
+    qd,qs=_series(sd,lambda s:s.get("quality") or None); sd_,sc=_series(sd,lambda s:s["score"]/20 if s.get("score") else None)
+    if not qs and not sc: no_data(ax); return
+    per=bin_period(len(sd))
+    if per and qs:
+        bx,mean,lo,hi=bin_series([d.date() for d in qd],qs,per); bn=mdates.date2num(bx)
+        ax.fill_between(bn,lo,hi,alpha=0.12,color=T.TEAL,linewidth=0)
+        ax.plot(bn,mean,color=T.TEAL,linewidth=1.8,label="Quality (avg)")
+    elif qs: ax.scatter(mdates.date2num(qd),qs,c=[QUALITY_COLOURS.get(int(round(q)),T.TEXT_MUTED) for q in qs],s=50,zorder=3,label="Quality")
+    if sc:
+        x,y=lttb(mdates.date2num(sd_),sc,int(px))
+        ax.plot(x,y,color=T.BLUE,linewidth=1.5 if not per else 0.9,alpha=0.7,linestyle="--",label="Score/20")
+    ax.set_ylim(0,5.5); ax.set_ylabel("Rating",fontsize=9)
+    ax.set_xlim(mdates.date2num(datetime.strptime(sd[0][0],"%Y-%m-%d"))-0.5,mdates.date2num(datetime.strptime(sd[-1][0],"%Y-%m-%d"))+0.5)
+    ax.legend(loc="upper left",fontsize=7,facecolor=T.CHART_BG,edgecolor=T.BORDER,labelcolor=T.TEXT_SEC)
+    date_axis(ax,px)
+def draw_factor_impact(ax, res):
+    """Score with vs without each factor, 95% CI (faded where it spans zero). Returns the insight text."""
+    singles=sorted([r for r in res if len(r["factors"])==1 and r["ok"]],key=lambda r:r["score"][0])
+    sig=[r for r in res if r["ok"] and abs(r["score"][0])>r["score"][1]]
+    if singles:
+        ds=[r["score"][0] for r in singles]; cis=[r["score"][1] for r in singles]
+        bc=[T.RED if d<0 else T.GREEN for d in ds]
+        bars=ax.barh(range(len(singles)),ds,xerr=cis,color=bc,height=0.5,error_kw={"ecolor":T.TEXT_MUTED,"lw":0.8,"capsize":2})
+        for b,r in zip(bars,singles): b.set_alpha(0.85 if abs(r["score"][0])>r["score"][1] else 0.3)
+        ax.axvline(0,color=T.CHART_GRID,linewidth=0.8)
+        ax.set_yticks(range(len(singles))); ax.set_yticklabels([f"{r['label']} ({r['n']})" for r in singles],fontsize=8)
+        ax.set_xlabel("Score points vs nights without",fontsize=9)
+    else: ax.text(0.5,0.5,f"Needs {FactorImpact.MIN_N}+ nights with and without a factor",transform=ax.transAxes,
+                  ha="center",va="center",color=T.TEXT_MUTED,fontsize=10)
+    top=sorted([r for r in sig if len(r["factors"])==1],key=lambda r:-abs(r["score"][0]))[:3]
+    top+=sorted([r for r in sig if len(r["factors"])==2],key=lambda r:-abs(r["score"][0]))[:1]
+    few=[r["label"] for r in res if len(r["factors"])==1 and not r["ok"] and r["n"]]
+    txt="\n".join(FactorImpact.insight(r) for r in top) or "No factor has a clear effect on your score yet."
+    if few: txt+=f"\nNot enough nights yet: {', '.join(few)}"
+    return txt
+
 # ==============================================================================
 #  SECTION 6 : SIDEBAR
 # ==============================================================================
@@ -417,6 +1568,8 @@ class DashboardPage(ctk.CTkScrollableFrame):
                           font=ctk.CTkFont(size=13,weight="bold"),text_color=T.TEXT).pack(anchor="w")
             ctk.CTkLabel(left,text=f"{dh}h {dm_}m  |  {QUALITY_LABELS.get(q,'')}",font=ctk.CTkFont(size=11),
                           text_color=QUALITY_COLOURS.get(q,T.TEXT_SEC)).pack(anchor="w")
+            if sleep.get("sessions",1)>1:
+                ctk.CTkLabel(left,text=f"{sleep['sessions']} sessions incl. naps",font=ctk.CTkFont(size=10),text_color=T.TEXT_MUTED).pack(anchor="w")
             fcts=sleep.get("factors",[])
             if fcts: ctk.CTkLabel(left,text=", ".join(fcts),font=ctk.CTkFont(size=10),text_color=T.TEXT_MUTED).pack(anchor="w",pady=(2,0))
             sc_c=T.GREEN if sc!="--" and int(sc)>=70 else T.AMBER if sc!="--" and int(sc)>=50 else T.RED
@@ -587,7 +1740,7 @@ class SleepPage(ctk.CTkScrollableFrame):
             r=ctk.CTkFrame(fm,fg_color="transparent"); r.pack(fill="x",padx=T.PAD_MD,pady=2)
             ctk.CTkLabel(r,text=lbl,width=70,anchor="w",font=ctk.CTkFont(size=12),text_color=T.TEXT_SEC).pack(side="left")
             return r
-        dr=_tr("Date:")
+        dr=_tr("Woke on:")
         self.date_e=ctk.CTkEntry(dr,width=120,fg_color=T.INPUT_BG,border_color=T.INPUT_BD); self.date_e.pack(side="left"); self.date_e.insert(0,datetime.now().strftime("%Y-%m-%d"))
         br=_tr("Bedtime:")
         self.bh=ctk.CTkOptionMenu(br,values=[f"{h:02d}" for h in range(24)],width=60,fg_color=T.INPUT_BG,button_color=T.BORDER,dropdown_fg_color=T.SURFACE); self.bh.set("22"); self.bh.pack(side="left",padx=2)
@@ -622,28 +1775,27 @@ class SleepPage(ctk.CTkScrollableFrame):
 
     def _qc(self,val):
         q=int(round(val)); self.qv.set(q); self._ql.configure(text=QUALITY_LABELS.get(q,""),text_color=QUALITY_COLOURS.get(q,T.TEXT))
+    def _commit(self,e):
+        try: self.dm.log_sleep(e); return True
+        except SleepOverlap as x:
+            if not messagebox.askyesno("Overlapping sleep",f"{x}.\nReplace with {e['bedtime']}-{e['waketime']}?",parent=self.winfo_toplevel()): return False
+            self.dm.log_sleep(e,True); return True
     def _quick(self,hours):
-        now=datetime.now(); bed=now-timedelta(hours=hours)
-        rbt=[s.get("bedtime") for _,s in self.dm.sleep_for_range(7) if s]
-        sc=DataManager.calc_sleep_score(hours*60,4,rbt)
-        self.dm.log_sleep({"date":now.strftime("%Y-%m-%d"),"bedtime":bed.strftime("%H:%M"),"waketime":now.strftime("%H:%M"),
-                           "duration_min":hours*60,"quality":4,"factors":[],"notes":f"Quick: {hours}h","score":sc})
-        self.toast.show(f"Logged {hours}h  |  Score: {sc}","success"); self.refresh()
+        now=datetime.now(); e=self.dm.make_session(now-timedelta(hours=hours),now,4,[],f"Quick: {hours}h")
+        if not self._commit(e): return
+        self.toast.show(f"Logged {hours}h for {e['date']}  |  Score: {e['score']}","success"); self.refresh()
     def _log(self):
-        ds=self.date_e.get().strip(); bhv,bmv=int(self.bh.get()),int(self.bm.get()); whv,wmv=int(self.wh.get()),int(self.wm.get())
-        bt=bhv*60+bmv; wt=whv*60+wmv; dur=(wt-bt) if wt>bt else (1440-bt+wt)
-        if dur<=0 or dur>1080: messagebox.showwarning("Invalid","Check your times.",parent=self.winfo_toplevel()); return
-        q=self.qv.get(); fcts=[f for f,v in self._fvars.items() if v.get()]; notes=self.ntb.get("1.0","end").strip()
-        rbt=[s.get("bedtime") for _,s in self.dm.sleep_for_range(7) if s]
-        sc=DataManager.calc_sleep_score(dur,q,rbt)
-        self.dm.log_sleep({"date":ds,"bedtime":f"{bhv:02d}:{bmv:02d}","waketime":f"{whv:02d}:{wmv:02d}",
-                           "duration_min":dur,"quality":q,"factors":fcts,"notes":notes,"score":sc})
-        self.toast.show(f"Sleep logged!  Score: {sc}/100","success"); self.ntb.delete("1.0","end")
+        fcts=[f for f,v in self._fvars.items() if v.get()]; notes=self.ntb.get("1.0","end").strip()
+        try: e=self.dm.make_sleep_entry(self.date_e.get().strip(),f"{self.bh.get()}:{self.bm.get()}",
+                                          f"{self.wh.get()}:{self.wm.get()}",self.qv.get(),fcts,notes)
+        except ValueError: messagebox.showwarning("Invalid","Check your date and times.",parent=self.winfo_toplevel()); return
+        if not self._commit(e): return
+        self.toast.show(f"Sleep logged!  Score: {e['score']}/100","success"); self.ntb.delete("1.0","end")
         for v in self._fvars.values(): v.set(False)
         self.refresh()
     def refresh(self):
         for w in self._hf.winfo_children(): w.destroy()
-        entries=sorted(self.dm.data["sleep_log"],key=lambda s:s["date"],reverse=True)[:10]
+        entries=self.dm.recent_sessions(10)
         if not entries: ctk.CTkLabel(self._hf,text="No entries yet.",font=ctk.CTkFont(size=12),text_color=T.TEXT_MUTED).pack(pady=T.PAD_LG); return
         for s in entries:
             q=s.get("quality",3); dh,dm_=s.get("duration_min",0)//60,s.get("duration_min",0)%60; sc=s.get("score","--")
@@ -651,6 +1803,7 @@ class SleepPage(ctk.CTkScrollableFrame):
             inn=ctk.CTkFrame(row,fg_color="transparent"); inn.pack(fill="x",padx=T.PAD_MD,pady=T.PAD_SM)
             ctk.CTkLabel(inn,text=s["date"],width=85,font=ctk.CTkFont(size=11),text_color=T.TEXT_MUTED).pack(side="left")
             ctk.CTkLabel(inn,text=f"{dh}h {dm_}m",font=ctk.CTkFont(size=12,weight="bold"),text_color=T.TEXT).pack(side="left",padx=T.PAD_SM)
+            ctk.CTkLabel(inn,text=f"{s.get('bedtime','--')}-{s.get('waketime','--')}",font=ctk.CTkFont(size=11),text_color=T.TEXT_MUTED).pack(side="left",padx=(0,T.PAD_SM))
             ctk.CTkLabel(inn,text=QUALITY_LABELS.get(q,""),font=ctk.CTkFont(size=11),text_color=QUALITY_COLOURS.get(q,T.TEXT_SEC)).pack(side="left")
             sc_c=T.GREEN if sc!="--" and sc>=70 else T.AMBER if sc!="--" and sc>=50 else T.RED
             ctk.CTkLabel(inn,text=f"  {sc}",font=ctk.CTkFont(size=12,weight="bold"),text_color=sc_c).pack(side="right")
@@ -658,6 +1811,7 @@ class SleepPage(ctk.CTkScrollableFrame):
 
 # ── 7D : ANALYTICS ───────────────────────────────────────────────────────────
 class AnalyticsPage(ctk.CTkScrollableFrame):
+    RANGES={"7d":7,"14d":14,"30d":30,"90d":90,"1y":365,"All":None}
     def __init__(self, parent, dm, **kw):
         super().__init__(parent,fg_color=T.BG,scrollbar_button_color=T.BORDER,
                          scrollbar_button_hover_color=T.TEXT_MUTED,**kw)
@@ -669,88 +1823,47 @@ class AnalyticsPage(ctk.CTkScrollableFrame):
         self.sq=StatCard(sr,"Avg Quality","--","",T.TEAL); self.sq.grid(row=0,column=1,padx=3,pady=3,sticky="nsew")
         self.sh=StatCard(sr,"Adherence","--","",T.GREEN); self.sh.grid(row=0,column=2,padx=3,pady=3,sticky="nsew")
         self.ss=StatCard(sr,"Avg Score","--","",T.BLUE); self.ss.grid(row=0,column=3,padx=3,pady=3,sticky="nsew")
-        rr=ctk.CTkFrame(self,fg_color="transparent"); rr.pack(fill="x",padx=T.PAD_LG,pady=(T.PAD_SM,4))
-        self._rv=ctk.StringVar(value="14")
-        for v,l in [("7","7 days"),("14","14 days"),("30","30 days")]:
-            ctk.CTkRadioButton(rr,text=l,variable=self._rv,value=v,font=ctk.CTkFont(size=11),text_color=T.TEXT_SEC,
-                                fg_color=T.BLUE,hover_color=T.HOVER,border_color=T.BORDER,command=self.refresh).pack(side="left",padx=T.PAD_SM)
+        rr=ctk.CTkFrame(self,fg_color="transparent"); rr.pack(fill="x",padx=T.PAD_MD,pady=(T.PAD_SM,4))
+        self._days=14
+        self._rsel=ctk.CTkSegmentedButton(rr,values=list(self.RANGES)+["Custom"],font=ctk.CTkFont(size=11),
+                                          selected_color=T.BLUE,selected_hover_color=T.BLUE,unselected_color=T.SURFACE,
+                                          unselected_hover_color=T.HOVER,text_color=T.TEXT,command=self._range)
+        self._rsel.set("14d"); self._rsel.pack(fill="x")
         self.ch_adh=ChartFrame(self,title="Medication Adherence (%)",height=180); self.ch_adh.pack(fill="x",padx=T.PAD_MD,pady=T.PAD_SM)
         self.ch_dur=ChartFrame(self,title="Sleep Duration (hours)",height=180); self.ch_dur.pack(fill="x",padx=T.PAD_MD,pady=T.PAD_SM)
         self.ch_q=ChartFrame(self,title="Sleep Quality & Score",height=180); self.ch_q.pack(fill="x",padx=T.PAD_MD,pady=T.PAD_SM)
-        self.ch_f=ChartFrame(self,title="Sleep Factor Frequency",height=160); self.ch_f.pack(fill="x",padx=T.PAD_MD,pady=(T.PAD_SM,T.PAD_LG))
+        self.ch_f=ChartFrame(self,title="Sleep Factor Impact on Score (all history)",height=200); self.ch_f.pack(fill="x",padx=T.PAD_MD,pady=(T.PAD_SM,4))
+        self._fi=ctk.CTkLabel(self,text="",font=ctk.CTkFont(size=11),text_color=T.TEXT_SEC,justify="left",anchor="w",wraplength=420)
+        self._fi.pack(fill="x",padx=T.PAD_LG,pady=(0,T.PAD_LG))
+
+    def _range(self, v):
+        if v=="Custom":
+            ans=ctk.CTkInputDialog(text="Days to show, or a start date (YYYY-MM-DD):",title="Custom range").get_input()
+            try: self._days=max(1,int(ans)) if ans and ans.strip().isdigit() else (datetime.now()-datetime.strptime(ans.strip(),"%Y-%m-%d")).days+1
+            except (ValueError, AttributeError): pass
+            self._days=max(1,min(self._days,36500))
+        else: self._days=self.RANGES[v] or self.dm.history_days()
+        self.refresh()
 
     def refresh(self):
-        days=int(self._rv.get()); sd=self.dm.sleep_for_range(days); se=[s for _,s in sd if s]
-        if se:
-            ad=sum(s["duration_min"] for s in se)/len(se); ah,am=int(ad//60),int(ad%60); self.sa.update_values(f"{ah}h {am}m",f"{len(se)} nights")
-            aq=sum(s.get("quality",3) for s in se)/len(se); self.sq.update_values(f"{aq:.1f}/5",QUALITY_LABELS.get(round(aq),""))
-            scs=[s.get("score",0) for s in se if s.get("score")]; asc=sum(scs)/len(scs) if scs else 0; self.ss.update_values(f"{asc:.0f}","out of 100")
+        allr=self._rsel.get()=="All"; days=self.dm.history_days() if allr else self._days
+        sd=self.dm.sleep_for_range(days); adh=self.dm.adherence_for_range(days); span="all time" if allr else f"last {days}d"
+        st=range_stats(sd,adh,bool(self.dm.meds))
+        if st["nights"]:
+            ad=st["avg_sleep_min"]; ah,am=int(ad//60),int(ad%60); self.sa.update_values(f"{ah}h {am}m",f"{st['nights']} nights")
+            aq=st["avg_quality"]; self.sq.update_values(f"{aq:.1f}/5",QUALITY_LABELS.get(round(aq),""))
+            self.ss.update_values(f"{st['avg_score']:.0f}","out of 100")
         else: self.sa.update_values("--","No data"); self.sq.update_values("--",""); self.ss.update_values("--","")
-        adh=self.dm.adherence_for_range(days)
-        if adh and self.dm.meds:
-            aa=sum(v for _,v in adh)/len(adh)*100; self.sh.update_values(f"{aa:.0f}%",f"last {days}d")
+        if st["adherence_pct"] is not None: self.sh.update_values(f"{st['adherence_pct']:.0f}%",span)
         else: self.sh.update_values("--","")
 
-        # Adherence chart
-        ax=self.ch_adh.ax; self.ch_adh.redraw()
-        if adh and self.dm.meds:
-            dates=[d[-5:] for d,_ in adh]; vals=[v*100 for _,v in adh]
-            cols=[T.GREEN if v>=100 else T.AMBER if v>=50 else T.RED for v in vals]
-            ax.bar(range(len(dates)),vals,color=cols,width=0.6,alpha=0.85)
-            ax.set_xticks(range(len(dates))); ax.set_xticklabels(dates,rotation=45,ha="right",fontsize=7)
-            ax.set_ylim(0,110); ax.set_ylabel("%",fontsize=9); ax.axhline(y=100,color=T.GREEN,linewidth=0.5,alpha=0.3,linestyle="--")
-        else: ax.text(0.5,0.5,"No data",transform=ax.transAxes,ha="center",va="center",color=T.TEXT_MUTED,fontsize=11)
+        self.ch_adh.redraw()
+        if self.dm.meds: draw_adherence(self.ch_adh.ax,adh,self.ch_adh.px())
+        else: no_data(self.ch_adh.ax)
         self.ch_adh.render()
-
-        # Duration chart
-        ax2=self.ch_dur.ax; self.ch_dur.redraw()
-        if se:
-            dts=[]; durs=[]
-            for d,s in sd: dts.append(d[-5:]); durs.append(s["duration_min"]/60 if s else None)
-            vx=[i for i,d in enumerate(durs) if d is not None]; vy=[durs[i] for i in vx]
-            if vy:
-                ax2.fill_between(vx,vy,alpha=0.15,color=T.PURPLE)
-                ax2.plot(vx,vy,color=T.PURPLE,linewidth=2,marker="o",markersize=4,markerfacecolor=T.PURPLE)
-                ax2.axhspan(7,9,alpha=0.05,color=T.GREEN)
-                ax2.set_xticks(range(len(dts))); ax2.set_xticklabels(dts,rotation=45,ha="right",fontsize=7)
-                ax2.set_ylabel("Hours",fontsize=9); ax2.set_ylim(0,max(12,max(vy)+1))
-        else: ax2.text(0.5,0.5,"No data",transform=ax2.transAxes,ha="center",va="center",color=T.TEXT_MUTED,fontsize=11)
-        self.ch_dur.render()
-
-        # Quality chart
-        ax3=self.ch_q.ax; self.ch_q.redraw()
-        if se:
-            dts=[]; qs=[]; scs=[]
-            for d,s in sd:
-                dts.append(d[-5:])
-                if s: qs.append(s.get("quality",0)); scs.append(s.get("score",0)/20)
-                else: qs.append(None); scs.append(None)
-            vq=[(i,q) for i,q in enumerate(qs) if q]; vs=[(i,s) for i,s in enumerate(scs) if s]
-            if vq:
-                qx,qy=zip(*vq); qc=[QUALITY_COLOURS.get(int(round(q)),T.TEXT_MUTED) for q in qy]
-                ax3.scatter(qx,qy,c=qc,s=50,zorder=3,label="Quality")
-            if vs:
-                sx,sy=zip(*vs); ax3.plot(sx,sy,color=T.BLUE,linewidth=1.5,alpha=0.7,linestyle="--",label="Score/20")
-            ax3.set_xticks(range(len(dts))); ax3.set_xticklabels(dts,rotation=45,ha="right",fontsize=7)
-            ax3.set_ylim(0,5.5); ax3.set_ylabel("Rating",fontsize=9)
-            ax3.legend(loc="upper left",fontsize=7,facecolor=T.CHART_BG,edgecolor=T.BORDER,labelcolor=T.TEXT_SEC)
-        else: ax3.text(0.5,0.5,"No data",transform=ax3.transAxes,ha="center",va="center",color=T.TEXT_MUTED,fontsize=11)
-        self.ch_q.render()
-
-        # Factors chart
-        ax4=self.ch_f.ax; self.ch_f.redraw()
-        if se:
-            fc=defaultdict(int)
-            for s in se:
-                for f in s.get("factors",[]): fc[f]+=1
-            if fc:
-                sf=sorted(fc.items(),key=lambda x:x[1],reverse=True); ns=[f[0] for f in sf]; cs=[f[1] for f in sf]
-                bc=[T.AMBER if n in ("Caffeine","Alcohol","Screen Time","Stress","Late Meal") else T.GREEN for n in ns]
-                ax4.barh(range(len(ns)),cs,color=bc,height=0.5,alpha=0.85)
-                ax4.set_yticks(range(len(ns))); ax4.set_yticklabels(ns,fontsize=8); ax4.set_xlabel("Count",fontsize=9); ax4.invert_yaxis()
-            else: ax4.text(0.5,0.5,"No factors logged",transform=ax4.transAxes,ha="center",va="center",color=T.TEXT_MUTED,fontsize=11)
-        else: ax4.text(0.5,0.5,"No data",transform=ax4.transAxes,ha="center",va="center",color=T.TEXT_MUTED,fontsize=11)
-        self.ch_f.render()
+        self.ch_dur.redraw(); draw_duration(self.ch_dur.ax,sd,self.ch_dur.px()); self.ch_dur.render()
+        self.ch_q.redraw(); draw_quality(self.ch_q.ax,sd,self.ch_q.px()); self.ch_q.render()
+        self.ch_f.redraw(); self._fi.configure(text=draw_factor_impact(self.ch_f.ax,self.dm.factor_impact())); self.ch_f.render()
 
 # ── 7E : SETTINGS ────────────────────────────────────────────────────────────
 class SettingsPage(ctk.CTkScrollableFrame):
@@ -776,9 +1889,36 @@ class SettingsPage(ctk.CTkScrollableFrame):
                        command=self._ta).pack(anchor="w",padx=T.PAD_LG,pady=4)
         self._sect("Data Management")
         for txt,cmd,clr in [("Export Data (JSON)",self._exp,T.BLUE),("Export Pill Log (CSV)",self._csv,T.BLUE),
-                             ("Import Data (JSON)",self._imp,T.BLUE),("Open Data Folder",self._folder,T.TEXT_SEC)]:
-            ctk.CTkButton(self,text=txt,height=34,font=ctk.CTkFont(size=12),fg_color=T.SURFACE,hover_color=T.HOVER,
-                           text_color=clr,border_width=1,border_color=T.BORDER,anchor="w",command=cmd).pack(fill="x",padx=T.PAD_LG,pady=2)
+                             ("Import Data (JSON)",self._imp,T.BLUE),("Import Sleep (Apple Health, Fitbit, Google)...",self._imp_sleep,T.BLUE),
+                             ("Back Up Now",self._bak,T.BLUE),("Restore from Backup...",self._restore,T.BLUE),("Open Data Folder",self._folder,T.TEXT_SEC)]:
+            b=ctk.CTkButton(self,text=txt,height=34,font=ctk.CTkFont(size=12),fg_color=T.SURFACE,hover_color=T.HOVER,
+                             text_color=clr,border_width=1,border_color=T.BORDER,anchor="w",command=cmd); b.pack(fill="x",padx=T.PAD_LG,pady=2)
+            if cmd==self._imp_sleep: self._isb=b
+        self._importer=None; self._ipf=ctk.CTkFrame(self,fg_color="transparent")
+        self._ipb=ctk.CTkProgressBar(self._ipf,height=8,fg_color=T.BORDER,progress_color=T.PURPLE); self._ipb.pack(fill="x",pady=(4,2))
+        ir=ctk.CTkFrame(self._ipf,fg_color="transparent"); ir.pack(fill="x")
+        self._ipl=ctk.CTkLabel(ir,text="",font=ctk.CTkFont(size=10),text_color=T.TEXT_MUTED,anchor="w"); self._ipl.pack(side="left",fill="x",expand=True)
+        ctk.CTkButton(ir,text="Cancel",width=60,height=22,font=ctk.CTkFont(size=10),fg_color=T.SURFACE,hover_color=T.HOVER,text_color=T.TEXT_SEC,
+                       border_width=1,border_color=T.BORDER,command=lambda:self._importer and self._importer.cancel.set()).pack(side="right")
+        self._sect("Recent Changes")
+        self._hist=ctk.CTkFrame(self,fg_color="transparent"); self._hist.pack(fill="x",padx=T.PAD_LG)
+        hr=ctk.CTkFrame(self,fg_color="transparent"); hr.pack(fill="x",padx=T.PAD_LG,pady=4)
+        for txt,cmd in [("Undo  (Ctrl+Z)",self.app.undo),("Redo  (Ctrl+Y)",self.app.redo)]:
+            ctk.CTkButton(hr,text=txt,height=28,font=ctk.CTkFont(size=11),fg_color=T.SURFACE,hover_color=T.HOVER,text_color=T.TEXT_SEC,
+                           border_width=1,border_color=T.BORDER,command=cmd).pack(side="left",fill="x",expand=True,padx=(0,4))
+        self._sect("Local API")
+        self._apv=ctk.BooleanVar(value=self.dm.settings["api_enabled"])
+        ctk.CTkSwitch(self,text=f"Enable JSON API on 127.0.0.1:{self.dm.settings['api_port']}",variable=self._apv,font=ctk.CTkFont(size=12),
+                       text_color=T.TEXT_SEC,fg_color=T.BORDER,progress_color=T.BLUE,button_color=T.TEXT,button_hover_color=T.BLUE,
+                       command=self._tapi).pack(anchor="w",padx=T.PAD_LG,pady=4)
+        self._apl=ctk.CTkLabel(self,text="",font=ctk.CTkFont(size=10),text_color=T.TEXT_MUTED,justify="left"); self._apl.pack(anchor="w",padx=T.PAD_LG)
+        self._sect("Responsiveness")
+        self._wdl=ctk.CTkLabel(self,text="",font=ctk.CTkFont(size=10),text_color=T.TEXT_MUTED,justify="left",anchor="w")
+        self._wdl.pack(fill="x",padx=T.PAD_LG)
+        wr=ctk.CTkFrame(self,fg_color="transparent"); wr.pack(fill="x",padx=T.PAD_LG,pady=4)
+        for txt,cmd in [("Refresh",self.refresh),("Open Stall Log",self._stall_log)]:
+            ctk.CTkButton(wr,text=txt,height=28,font=ctk.CTkFont(size=11),fg_color=T.SURFACE,hover_color=T.HOVER,text_color=T.TEXT_SEC,
+                           border_width=1,border_color=T.BORDER,command=cmd).pack(side="left",fill="x",expand=True,padx=(0,4))
         self._sect("Danger Zone",T.RED)
         ctk.CTkButton(self,text="Reset All Data",height=34,font=ctk.CTkFont(size=12),fg_color=T.SURFACE,
                        hover_color="#2a0d0d",text_color=T.RED,border_width=1,border_color=T.BTN_DNG,
@@ -788,6 +1928,10 @@ class SettingsPage(ctk.CTkScrollableFrame):
                       font=ctk.CTkFont(size=11),text_color=T.TEXT_MUTED,justify="left").pack(anchor="w",padx=T.PAD_LG,pady=(4,T.PAD_LG))
     def _so(self,v): self.dm.settings["opacity"]=round(v,2); self.app.attributes("-alpha",v); self._ol.configure(text=f"{int(v*100)}%")
     def _ta(self): self.dm.settings["always_on_top"]=self._av.get(); self.app.attributes("-topmost",self._av.get())
+    def _tapi(self):
+        self.dm.settings["api_enabled"]=self._apv.get(); err=self.app.set_api(self._apv.get())
+        if err: self._apv.set(False); self.dm.settings["api_enabled"]=False
+        self.refresh()
     def _exp(self):
         fp=filedialog.asksaveasfilename(parent=self.winfo_toplevel(),defaultextension=".json",filetypes=[("JSON","*.json")],initialfile="pillsleep_backup.json")
         if fp: DataManager._write(Path(fp),self.dm.data); messagebox.showinfo("Done",f"Exported to:\n{fp}",parent=self.winfo_toplevel())
@@ -802,50 +1946,112 @@ class SettingsPage(ctk.CTkScrollableFrame):
         fp=filedialog.askopenfilename(parent=self.winfo_toplevel(),filetypes=[("JSON","*.json")])
         if fp:
             try:
-                with open(fp,"r",encoding="utf-8") as f: imp=json.load(f)
-                if any(k in imp for k in ("medications","med_log","sleep_log","pills")):
-                    if "pills" in imp and "medications" not in imp:
-                        imp["medications"]=imp.pop("pills")
-                        for m in imp["medications"]: m.setdefault("id",str(uuid.uuid4()))
-                    if "pill_log" in imp and "med_log" not in imp:
-                        imp["med_log"]=imp.pop("pill_log")
-                        for l in imp["med_log"]: l.setdefault("med_id",l.get("pill_name","")); l.setdefault("med_name",l.get("pill_name",""))
-                    self.dm.data=imp
-                    for k in ("medications","med_log","sleep_log"): self.dm.data.setdefault(k,[])
-                    self.dm.save_data(); messagebox.showinfo("Done","Imported!",parent=self.winfo_toplevel())
+                with open(fp,"r",encoding="utf-8") as f: imp=migrate_import(json.load(f))
+                if imp:
+                    self.dm.replace_data(imp,"Imported data"); messagebox.showinfo("Done","Imported!",parent=self.winfo_toplevel())
                 else: messagebox.showwarning("Invalid","Not valid tracker data.",parent=self.winfo_toplevel())
             except Exception as e: messagebox.showerror("Error",str(e),parent=self.winfo_toplevel())
-    def _folder(self):
+    def _imp_sleep(self):
+        if self._importer: return
+        fps=filedialog.askopenfilenames(parent=self.winfo_toplevel(),title="Sleep exports",
+                                        filetypes=[("Exports","*.zip *.xml *.json *.csv"),("All files","*.*")])
+        if not fps: return
+        self._importer=SleepImporter(self.dm,fps).start()
+        self._ipb.set(0); self._ipf.pack(fill="x",padx=T.PAD_LG,after=self._isb); self._ipoll()
+    def _ipoll(self):
+        im=self._importer
+        self._ipb.set(im.progress)
+        self._ipl.configure(text=f"{im.progress*100:.0f}%  |  {im.added} added, {im.skipped} skipped  |  {im.current}")
+        if not im.done: self.after(250,self._ipoll); return
+        self._ipf.pack_forget(); self._importer=None
+        if im.error: messagebox.showerror("Sleep import stopped",f"{im.error}\n\n{im.added} sessions were imported before this.",parent=self.winfo_toplevel())
+        else: self.app.toast.show(f"{'Import cancelled' if im.cancel.is_set() else 'Sleep import done'}: {im.added} added, {im.skipped} skipped",
+                                  "warning" if im.cancel.is_set() else "success",6000)
+    def _bak(self):
+        try: k=self.app.backups.checkpoint()
+        except (OSError, ValueError) as e: messagebox.showerror("Backup failed",str(e),parent=self.winfo_toplevel()); return
+        self.app.toast.show("Backup saved" if k else "No changes since last backup","success" if k else "info")
+    def _restore(self):
+        bm=self.app.backups; dlg=ctk.CTkToplevel(self.winfo_toplevel())
+        dlg.title("Restore from Backup"); dlg.geometry("440x480"); dlg.configure(fg_color=T.BG)
+        dlg.attributes("-topmost",True); dlg.grab_set()
+        ctk.CTkLabel(dlg,text=f"{len(bm.entries)} backup points in {BACKUP_DIR}",font=ctk.CTkFont(size=11),
+                      text_color=T.TEXT_MUTED,wraplength=400,justify="left").pack(anchor="w",padx=T.PAD_MD,pady=(T.PAD_MD,4))
+        sc=ctk.CTkScrollableFrame(dlg,fg_color=T.BG); sc.pack(fill="both",expand=True,padx=T.PAD_SM,pady=(0,T.PAD_SM))
+        def _go(e):
+            try: data=bm.restore(e)
+            except (OSError, ValueError, KeyError, StopIteration) as ex:
+                messagebox.showerror("Cannot restore",f"Backup failed verification:\n{ex}",parent=dlg); return
+            if not messagebox.askyesno("Restore",f"Replace current data with the backup from {e['ts'].replace('T','  ')}?\n"
+                                       "Current data is backed up first.",parent=dlg): return
+            try: bm.checkpoint()
+            except (OSError, ValueError): pass
+            self.dm.replace_data(data,"Restored backup"); dlg.destroy(); self.app.toast.show("Backup restored","success")
+        if not bm.entries:
+            ctk.CTkLabel(sc,text="No backups yet.",font=ctk.CTkFont(size=12),text_color=T.TEXT_MUTED).pack(pady=T.PAD_LG)
+        for e in reversed(bm.entries):
+            c=e["counts"]; row=ctk.CTkFrame(sc,fg_color=T.CARD,corner_radius=6,border_width=1,border_color=T.BORDER); row.pack(fill="x",pady=2)
+            inn=ctk.CTkFrame(row,fg_color="transparent"); inn.pack(fill="x",padx=T.PAD_SM,pady=6)
+            info=ctk.CTkFrame(inn,fg_color="transparent"); info.pack(side="left",fill="x",expand=True)
+            ctk.CTkLabel(info,text=e["ts"].replace("T","  "),font=ctk.CTkFont(size=12,weight="bold"),text_color=T.TEXT).pack(anchor="w")
+            ctk.CTkLabel(info,text=f"{e['kind']}  |  {c['medications']} meds, {c['med_log']} doses, {c['sleep_log']} sleeps",
+                          font=ctk.CTkFont(size=10),text_color=T.TEXT_SEC if e["kind"]=="full" else T.TEXT_MUTED).pack(anchor="w")
+            ctk.CTkButton(inn,text="Restore",width=70,height=28,font=ctk.CTkFont(size=11),fg_color=T.SURFACE,hover_color=T.HOVER,
+                           text_color=T.BLUE,command=lambda e=e:_go(e)).pack(side="right")
+    def _stall_log(self):
+        if not STALL_LOG.exists(): messagebox.showinfo("Stall Log","No stalls recorded yet.",parent=self.winfo_toplevel()); return
+        self._folder(STALL_LOG)
+    def _folder(self, path=DATA_DIR):
         try:
-            if sys.platform=="win32": os.startfile(DATA_DIR)
-            elif sys.platform=="darwin": subprocess.Popen(["open",str(DATA_DIR)])
-            else: subprocess.Popen(["xdg-open",str(DATA_DIR)])
-        except: messagebox.showinfo("Path",str(DATA_DIR),parent=self.winfo_toplevel())
+            if sys.platform=="win32": os.startfile(path)
+            elif sys.platform=="darwin": subprocess.Popen(["open",str(path)])
+            else: subprocess.Popen(["xdg-open",str(path)])
+        except: messagebox.showinfo("Path",str(path),parent=self.winfo_toplevel())
     def _reset(self):
-        if messagebox.askyesno("Reset","DELETE all data?\nCannot be undone!",parent=self.winfo_toplevel()):
-            self.dm.data={"medications":[],"med_log":[],"sleep_log":[]}; self.dm.save_data()
-    def refresh(self): pass
+        if messagebox.askyesno("Reset","DELETE all data?\nUndo (Ctrl+Z) brings it back until you close the tracker.",parent=self.winfo_toplevel()):
+            self.dm.replace_data({"medications":[],"med_log":[],"sleep_log":[]},"Reset data")
+    def refresh(self):
+        if self.app._api: self._apl.configure(text=f"Running  |  header X-PST-Token: {self.dm.settings['api_token']}\n"
+                                                     "GET /api/status, /api/sleep?days=N, /api/adherence?days=N\n"
+                                                     "POST (application/json) /api/take, /api/undo {med_id|name}, /api/sleep {start, end | bedtime, waketime, ...}")
+        else: self._apl.configure(text="Stopped")
+        self._wdl.configure(text=self.app.watchdog.summary() if self.app.watchdog else "Watchdog off (\"watchdog\" in settings.json)")
+        for w in self._hist.winfo_children(): w.destroy()
+        done,undone=self.dm.history(8)
+        rows=[(f"\u21B7  {op.label}",op,T.TEXT_MUTED) for op in undone]+[(f"\u2713  {op.label}",op,T.TEXT_SEC) for op in done]
+        if not rows: rows=[("Nothing to undo yet",None,T.TEXT_MUTED)]
+        for txt,op,clr in rows:
+            r=ctk.CTkFrame(self._hist,fg_color="transparent"); r.pack(fill="x")
+            ctk.CTkLabel(r,text=txt,font=ctk.CTkFont(size=11),text_color=clr,anchor="w").pack(side="left")
+            if op: ctk.CTkLabel(r,text=op.ts.strftime("%H:%M"),font=ctk.CTkFont(size=10),text_color=T.TEXT_MUTED).pack(side="right")
 
 # ==============================================================================
 #  SECTION 8 : MAIN APPLICATION
 # ==============================================================================
 class PillSleepTrackerPro(ctk.CTk):
+    EDIT_WIDGETS=(tk.Text,tk.Entry,tk.Spinbox,ttk.Entry)   # CTkEntry/CTkComboBox wrap tk.Entry; ttk.Combobox/Spinbox are ttk.Entry
     def __init__(self):
         super().__init__()
         ctk.set_appearance_mode("dark"); ctk.set_default_color_theme("dark-blue")
-        self.dm=DataManager(); s=self.dm.settings
+        self.dm=DataManager(); s=self.dm.settings; self.backups=BackupManager(self.dm)
         self.title("PillSleepTracker Pro")
         self.geometry(f"{s['window_w']}x{s['window_h']}+{s['window_x']}+{s['window_y']}")
         self.minsize(420,500); self.configure(fg_color=T.BG)
         self.attributes("-topmost",s["always_on_top"]); self.attributes("-alpha",s["opacity"])
-        self.protocol("WM_DELETE_WINDOW",self._close); self._drag={"x":0,"y":0}
+        self.protocol("WM_DELETE_WINDOW",self._close); self._drag={"x":0,"y":0}; self._api=None; self._blocked=False
+        self.watchdog=Watchdog(self,int(s["stall_ms"])) if s["watchdog"] else None
         self._build_tb()
         self.body=ctk.CTkFrame(self,fg_color=T.BG,corner_radius=0); self.body.pack(fill="both",expand=True)
         self.toast=ToastManager(self)
         self.sidebar=Sidebar(self.body,on_nav=self._nav); self.sidebar.pack(side="left",fill="y")
         self.content=ctk.CTkFrame(self.body,fg_color=T.BG,corner_radius=0); self.content.pack(side="left",fill="both",expand=True)
+        if self.dm.corrupt_file: self._recover()
         self.pages={}; self._build_pages(); self._nav(s.get("active_page","dashboard"))
         self._autosave(); self._tray=None
+        if s["api_enabled"]: self.set_api(True)
+        self._pump(); self.after(2000,self._watch)
+        self.bind_all("<Control-z>",self.undo); self.bind_all("<Control-y>",self.redo); self.bind_all("<Control-Shift-Z>",self.redo)
+        self.dm.listeners.append(self._changed)
         if HAS_TRAY and HAS_PIL: threading.Thread(target=self._setup_tray,daemon=True).start()
 
     def _build_tb(self):
@@ -874,15 +2080,75 @@ class PillSleepTrackerPro(ctk.CTk):
         for p in self.pages.values(): p.pack_forget()
         if k in self.pages: self.pages[k].pack(fill="both",expand=True); self.pages[k].refresh(); self.sidebar.set_active(k); self.dm.settings["active_page"]=k
 
+    def _pump(self):
+        # Apply writes queued by the API thread on the Tk thread, then refresh the open page
+        if self.dm.pump():
+            k=self.dm.settings.get("active_page")
+            if k in self.pages: self.pages[k].refresh()
+        self.after(150,self._pump)
+
+    def _watch(self):
+        # Pick up saves made by another instance (second launch, synced folder)
+        if self.dm.check_external():
+            k=self.dm.settings.get("active_page")
+            if k in self.pages: self.pages[k].refresh()
+            self.toast.show("Synced changes from another instance","info")
+        if self.dm.dirty!=self._blocked:
+            self._blocked=self.dm.dirty
+            if self._blocked: self.toast.show("Data file is locked by another instance - changes kept, retrying","warning",6000)
+            else: self.toast.show("Pending changes saved","success")
+        self.after(2000,self._watch)
+
+    def _changed(self, op, how):
+        # Pages refresh after their own writes; undo/redo can come from anywhere, so refresh here
+        if how!="do":
+            k=self.dm.settings.get("active_page")
+            if k in self.pages: self.pages[k].refresh()
+    def undo(self, e=None):
+        if e is not None and isinstance(e.widget,self.EDIT_WIDGETS): return None   # typing: leave Ctrl+Z to the field
+        op=self.dm.undo()
+        self.toast.show(f"Undone: {op.label}" if op else "Nothing to undo","info" if op else "warning")
+        return "break"
+    def redo(self, e=None):
+        if e is not None and isinstance(e.widget,self.EDIT_WIDGETS): return None
+        op=self.dm.redo()
+        self.toast.show(f"Redone: {op.label}" if op else "Nothing to redo","info" if op else "warning")
+        return "break"
+
+    def set_api(self, on):
+        if self._api: self._api.stop(); self._api=None
+        if not on: return None
+        if not self.dm.settings.get("api_token"):
+            self.dm.settings["api_token"]=secrets.token_urlsafe(24); self.dm.save_settings()
+        try:
+            self._api=ApiServer(self.dm,int(self.dm.settings["api_port"]),self.dm.settings.get("api_token",""))
+            self._api.start()
+        except OSError as e:
+            self._api=None; self.toast.show(f"API failed: {e.strerror or e}","error"); return e
+        return None
+
+    def _recover(self):
+        e,data=self.backups.recover_latest()
+        if e: self.dm.replace_data(data,"Restored backup"); msg=f"Data file was unreadable - restored backup from {e['ts'].replace('T',' ')}"
+        else: msg="Data file was unreadable and no backup verified - starting empty"
+        self.after(800,lambda:self.toast.show(msg,"warning",8000))
+
     def _autosave(self):
         try: self.dm.settings.update({"window_x":self.winfo_x(),"window_y":self.winfo_y(),"window_w":self.winfo_width(),"window_h":self.winfo_height()})
         except: pass
-        self.dm.save_settings(); self.after(30000,self._autosave)
+        self.dm.save_settings(); self.backups.maybe_checkpoint(); self.dm.write_cache(); self.after(30000,self._autosave)
 
     def _close(self):
+        if not self.dm.save_data(10) and not messagebox.askyesno("Unsaved changes",
+                "Another PillSleepTracker is holding the data file, so your latest changes are not saved.\n\nQuit anyway and lose them?",parent=self): return
         try: self.dm.settings.update({"window_x":self.winfo_x(),"window_y":self.winfo_y(),"window_w":self.winfo_width(),"window_h":self.winfo_height()})
         except: pass
-        self.dm.save_settings(); self.dm.save_data()
+        self.dm.save_settings()
+        try: self.backups.checkpoint()
+        except (OSError, ValueError): pass
+        self.dm.write_cache()
+        if self.watchdog: self.watchdog.stop()
+        if self._api: self._api.stop()
         if self._tray:
             try: self._tray.stop()
             except: pass
@@ -899,9 +2165,109 @@ class PillSleepTrackerPro(ctk.CTk):
         except: pass
     def _show_tray(self): self.deiconify(); self.attributes("-topmost",self.dm.settings["always_on_top"]); self.lift(); self.focus_force()
 
+# ==============================================================================
+#  SECTION 8B : BATCH REPORTS  (headless: python PillSleepTracker.py report DIR)
+# ==============================================================================
+REPORT_FIELDS=["user","file","days","nights","avg_sleep_h","avg_quality","avg_score","adherence_pct",
+               "pill_streak","sleep_streak","meds","top_insight","error"]
+
+def _report_one(path, out_dir, days, user=None):
+    """Worker: one tracker export -> <user>.png + <user>.html; returns its CSV summary row."""
+    row={"user":user or Path(path).stem,"file":str(path),"days":days}
+    try:
+        with open(path,"r",encoding="utf-8") as f: data=migrate_import(json.load(f))
+        if data is None: raise ValueError("not tracker data")
+        log=sorted(data["sleep_log"],key=lambda s:s.get("date",""))
+        for i,s in enumerate(log):   # exports from older versions may lack scores
+            if "score" not in s and s.get("duration_min"):
+                s["score"]=DataManager.calc_sleep_score(s["duration_min"],s.get("quality",3),[x.get("bedtime") for x in log[max(0,i-7):i] if x.get("bedtime")])
+        v=DataView(data); sd=v.sleep_for_range(days); adh=v.adherence_for_range(days)
+        st=range_stats(sd,adh,bool(v.meds)); res=FactorImpact().results(v.impact_nights())
+        fig=Figure(figsize=(8,11),dpi=100,facecolor=T.CHART_BG); FigureCanvasAgg(fig); axs=fig.subplots(4,1)
+        for ax,title in zip(axs,("Medication Adherence (%)","Sleep Duration (hours)","Sleep Quality & Score","Sleep Factor Impact on Score (all history)")):
+            style_axes(ax); ax.set_title(title,color=T.TEXT,fontsize=11,loc="left")
+        px=fig.get_figwidth()*fig.dpi*0.8
+        if v.meds: draw_adherence(axs[0],adh,px)
+        else: no_data(axs[0])
+        draw_duration(axs[1],sd,px); draw_quality(axs[2],sd,px); insight=draw_factor_impact(axs[3],res)
+        fig.tight_layout(pad=1.2); png=Path(out_dir)/f"{row['user']}.png"; fig.savefig(png,facecolor=T.CHART_BG)
+        row.update({"nights":st["nights"],"avg_sleep_h":round(st["avg_sleep_min"]/60,2) if st["nights"] else "",
+                    "avg_quality":round(st["avg_quality"],2) if st["nights"] else "",
+                    "avg_score":round(st["avg_score"],1) if st["avg_score"] is not None else "",
+                    "adherence_pct":round(st["adherence_pct"],1) if st["adherence_pct"] is not None else "",
+                    "pill_streak":v.pill_streak(),"sleep_streak":v.sleep_streak(),"meds":len(v.meds),
+                    "top_insight":insight.split("\n")[0]})
+        cells="".join(f"<tr><th>{html.escape(k.replace('_',' '))}</th><td>{html.escape(str(row[k]))}</td></tr>"
+                      for k in REPORT_FIELDS[2:11])
+        (Path(out_dir)/f"{row['user']}.html").write_text(
+            f"<!doctype html><meta charset='utf-8'><title>{html.escape(row['user'])} - PillSleepTracker report</title>"
+            f"<body style='background:{T.BG};color:{T.TEXT};font-family:Segoe UI,sans-serif;max-width:820px;margin:auto'>"
+            f"<h1>{html.escape(row['user'])}</h1><p style='color:{T.TEXT_SEC}'>Last {days} days as of {datetime.now():%Y-%m-%d}</p>"
+            f"<table style='border-collapse:collapse'>{cells}</table>"
+            f"<pre style='color:{T.TEXT_SEC}'>{html.escape(insight)}</pre><img src='{png.name}' width='800'></body>",encoding="utf-8")
+    except Exception as e: row["error"]=f"{type(e).__name__}: {e}"
+    return row
+
+def run_reports(argv):
+    ap=argparse.ArgumentParser(prog="PillSleepTracker.py report",description="Per-user HTML/PNG reports and a CSV summary for a folder of tracker JSON exports.")
+    ap.add_argument("src",help="folder of tracker JSON files (searched recursively)")
+    ap.add_argument("-o","--out",default=None,help="output folder (default: SRC/reports)")
+    ap.add_argument("-d","--days",type=int,default=7,help="range for adherence/sleep stats (default 7)")
+    ap.add_argument("-j","--workers",type=int,default=None,help="worker processes (default: CPU count)")
+    a=ap.parse_args(argv); src=Path(a.src); out=Path(a.out) if a.out else src/"reports"
+    files=sorted(p for p in src.rglob("*.json") if out not in p.parents)
+    if not files: print(f"[PST] No .json files in {src}"); return 1
+    out.mkdir(parents=True,exist_ok=True); rows=[]; t0=time.monotonic(); users=set(); jobs=[]
+    for p in files:
+        # alice/pillsleep_backup.json -> alice__pillsleep_backup, so same-named exports never share outputs
+        base="__".join(p.relative_to(src).with_suffix("").parts); u=base; n=2
+        while u.lower() in users: u=f"{base}-{n}"; n+=1   # case-insensitive file systems
+        users.add(u.lower()); jobs.append((p,u))
+    with ProcessPoolExecutor(max_workers=a.workers) as pool:
+        futs=[pool.submit(_report_one,str(p),str(out),a.days,u) for p,u in jobs]
+        for i,f in enumerate(as_completed(futs),1):
+            r=f.result(); rows.append(r)
+            print(f"[PST] {i}/{len(files)}  {r['user']}" + (f"  FAILED: {r['error']}" if r.get("error") else ""))
+    rows.sort(key=lambda r:r["file"])
+    with open(out/"summary.csv","w",newline="",encoding="utf-8") as f:
+        w=csv.DictWriter(f,fieldnames=REPORT_FIELDS); w.writeheader(); w.writerows(rows)
+    bad=sum(1 for r in rows if r.get("error"))
+    print(f"[PST] {len(rows)-bad} reports, {bad} failed, {time.monotonic()-t0:.1f}s  ->  {out}")
+    return 1 if bad==len(rows) else 0
+
 # ==============================================================================
 #  SECTION 9 : ENTRY POINT
 # ==============================================================================
+class InstanceGuard:
+    """Holds instance.lock while running; a second launch asks the first to show itself instead."""
+    def __init__(self): self._lock=FileLock(INSTANCE_LOCK); self._sock=None
+    def claim(self):
+        if self._lock.acquire(timeout=0): return True
+        try:
+            with socket.create_connection(("127.0.0.1",int(INSTANCE_PORT.read_text())),timeout=2) as c: c.sendall(b"show")
+            return False
+        except (OSError, ValueError): return True   # holder unreachable: run anyway, the data lock still protects writes
+    def serve(self, on_show):
+        try:
+            self._sock=socket.socket(); self._sock.bind(("127.0.0.1",0)); self._sock.listen(2)
+            INSTANCE_PORT.write_text(str(self._sock.getsockname()[1]))
+        except OSError: return
+        def _loop():
+            while True:
+                try: c,_=self._sock.accept()
+                except OSError: return
+                with c:
+                    try:
+                        if c.recv(16)==b"show": on_show()
+                    except OSError: pass
+        threading.Thread(target=_loop,daemon=True).start()
+
 if __name__=="__main__":
+    if sys.argv[1:2]==["report"]: sys.exit(run_reports(sys.argv[2:]))
+    guard=None
+    if DataManager._load(SETTINGS_FILE,DEFAULT_SETTINGS).get("single_instance",True):
+        guard=InstanceGuard()
+        if not guard.claim(): sys.exit(0)
     app=PillSleepTrackerPro()
+    if guard: guard.serve(lambda:app.after(0,app._show_tray))
     app.mainloop()